@@ -7,23 +7,226 @@
 import numpy as np
 import pandas as pd
 import re
+import json
+import logging
+import shutil
+import hashlib
+import tempfile
+import heapq
+import os
+import sys
+import os.path as op
 from copy import copy
+from collections import deque, Counter
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
+# The matching functions log their progress at the DEBUG level, e.g. enable
+# with logging.getLogger('CERTGraph').setLevel(logging.DEBUG).
+logger = logging.getLogger(__name__)
+
+# Activity columns of the CERT logs, in the order in which _parse_row looks at
+# them, with the columns holding the tail and the head of the resulting edge
+# (the head of email edges is the generated email name).
+ACTIVITIES = [
+    ('email_activity', 'host', None),
+    ('file_activity', 'host', 'file_filename'),
+    ('device_activity', 'user', 'host'),
+    ('http_activity', 'host', 'http_url'),
+    ('logon_activity', 'user', 'host')]
+
+# Category of the vertices read from each column of the CERT logs. The emails
+# are in the 'email' category and the attached files in the 'file' one.
+COLUMN_CATEGORIES = {
+    'user': 'user',
+    'host': 'host',
+    'file_filename': 'file',
+    'http_url': 'url'}
+
+# Binary graph files start with this magic string, followed by the length of a
+# json header (8 bytes, little endian), the header, then the arrays listed in
+# the header, each one aligned on BINARY_ALIGN bytes.
+BINARY_MAGIC = b'CERTGRPH'
+BINARY_VERSION = 1
+BINARY_ALIGN = 64
+
+# First line of the text graph files written by save, followed by the vertex
+# table (see read_graph_file).
+TEXT_VERTICES = '#vertices'
+TEXT_EDGES = '#edges'
+
+def _motif_types(edge_type):
+    """
+    Returns the set of the edge types allowed by the type of a motif edge,
+    which can be a type, a collection of types or None (any type, returned as
+    None).
+    """
+    if edge_type is None:
+        return None
+    if isinstance(edge_type, str):
+        return frozenset([edge_type])
+    return frozenset(edge_type)
+
+def _last_in_group(keys, is_source):
+    """
+    For arrays sorted by key (then by edge index), returns for each element
+    the position of the last source element at or before it with the same
+    key, or -1 if there is none.
+    """
+    n = len(keys)
+    pos = np.where(is_source, np.arange(n), -1)
+    np.maximum.accumulate(pos, out=pos)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if n else \
+        np.zeros(0, dtype=np.int64)
+    group_start = np.repeat(starts, np.diff(np.r_[starts, n]))
+    pos[pos < group_start] = -1
+    return pos
+
+def _align(size):
+    return -(-size // BINARY_ALIGN) * BINARY_ALIGN
+
+def _create_binary_file(path, arrays, header):
+    """
+    Creates a binary graph file with the given header and room for the given
+    arrays, and returns the position in the file at which each array starts.
+    
+    Args:
+    - path (str): path of the file to create;
+    - arrays (list of (name, dtype, shape)): the arrays stored in the file;
+    - header (dict): the other information stored in the header.
+    """
+    header = dict(header, version=BINARY_VERSION, arrays={})
+    size = 0
+    for name, dtype, shape in arrays:
+        dtype = np.dtype(dtype)
+        header['arrays'][name] = {
+            'dtype': dtype.str,
+            'shape': list(shape),
+            'offset': size}
+        size += _align(dtype.itemsize * int(np.prod(shape)))
+    raw = json.dumps(header).encode('utf-8')
+    start = _align(len(BINARY_MAGIC) + 8 + len(raw))
+    with open(path, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(len(raw).to_bytes(8, 'little'))
+        f.write(raw)
+        f.truncate(start + size)
+    return {name: start + desc['offset']
+            for name, desc in header['arrays'].items()}
+
+def _map_binary_array(path, dtype, shape, offset, mode='r'):
+    """
+    Maps an array of a binary graph file in memory.
+    """
+    if int(np.prod(shape)) == 0: # empty arrays can't be mapped
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape)
+
+# Edges of a sorted run written by Graph.read_data_stream, seq being the number
+# of the edge in the order of creation.
+RUN_DTYPE = np.dtype([
+    ('timestamp', np.int64),
+    ('seq', np.int64),
+    ('tail', np.int32),
+    ('head', np.int32),
+    ('type', np.int32)])
+
+def _merge_runs(runs, block):
+    """
+    Merges runs of edges (arrays of RUN_DTYPE sorted by timestamp, then seq),
+    and yields the merged edges by blocks. At most about 2 * block edges of
+    each run are held in memory.
+    """
+    pos = [0] * len(runs)
+    bufs = [run[:0] for run in runs]
+    while True:
+        for i, run in enumerate(runs):
+            if len(bufs[i]) < block and pos[i] < len(run):
+                bufs[i] = np.concatenate([bufs[i], run[pos[i]:pos[i]+block]])
+                pos[i] = min(pos[i] + block, len(run))
+        # all the edges up to the smallest last loaded edge of the runs that
+        # aren't fully loaded can be emitted
+        bounds = [(b['timestamp'][-1], b['seq'][-1])
+                  for b, p, run in zip(bufs, pos, runs) if p < len(run)]
+        out = []
+        for i, b in enumerate(bufs):
+            cut = len(b)
+            if bounds:
+                t, seq = min(bounds)
+                cut = int(np.count_nonzero((b['timestamp'] < t)
+                    | ((b['timestamp'] == t) & (b['seq'] <= seq))))
+            out.append(b[:cut])
+            bufs[i] = b[cut:]
+        out = np.concatenate(out) if out else np.empty(0, dtype=RUN_DTYPE)
+        if not len(out) and not bounds:
+            return
+        yield out[np.lexsort((out['seq'], out['timestamp']))]
+
+def _scatter(keys, edges, nxt, dest):
+    """
+    Counting sort step used to fill an adjacency index by chunks : puts the
+    edges in dest at the next free position of their key, in order.
+    """
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    uniq, first, counts = np.unique(keys, return_index=True,
+                                    return_counts=True)
+    rank = np.arange(len(keys)) - np.repeat(first, counts)
+    dest[nxt[keys] + rank] = edges[order]
+    nxt[uniq] += counts
+
+def _encode_strings(strings):
+    """
+    Encodes a list of strings as a byte array and an array of offsets : string
+    i is data[offsets[i]:offsets[i+1]].
+    """
+    encoded = [str(s).encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+def _decode_strings(data, offsets):
+    """
+    Inverse of _encode_strings.
+    """
+    raw = data.tobytes()
+    offsets = offsets.tolist()
+    return [raw[offsets[i]:offsets[i+1]].decode('utf-8')
+            for i in range(len(offsets) - 1)]
+
+def _renumber_vertices(tails, heads):
+    """
+    Renumbers the vertices of the edges of the given tails and heads to
+    0, 1, ... Returns the sorted array of the old indices of the vertices,
+    and the new tails and heads.
+    """
+    vertices, ends = np.unique(np.concatenate([tails, heads]),
+                               return_inverse=True)
+    ends = ends.reshape(-1).astype(np.int32)
+    return vertices, ends[:len(tails)], ends[len(tails):]
+
 class Vertex():
     '''
     A vertex of the CERT dataset graph.
     
     Args:
-    - name (str): name of the vertex (identifier, must be unique).
+    - name (str): name of the vertex (identifier, must be unique);
+    - category (str): kind of the vertex, 'user', 'host', 'file', 'url' or
+    'email' (defaults to None, unknown). In a motif, the category the matched
+    vertices must have, None for any.
     '''
     
-    def __init__(self, name):
+    __slots__ = ('name', 'category')
+    
+    def __init__(self, name, category=None):
         # consider adding an index to speed up the search in to_vertices
         self.name = name
+        self.category = category
     
     def __repr__(self):
-        return "Vertex {}".format(self.name)
+        return "Vertex {}, category={}".format(self.name, self.category)
     
     def elements_as_str(self):
         return self.name
@@ -38,8 +241,12 @@ class Edge():
     - tail (str): name of the vertex this edge is emanating from;
     - head (str): name of the vertex this edge is pointing to;
     - edge_type (str): type of the edge (defaults to None). Useful for debugging.
+    In a motif, the type the matched edges must have : a type, a set of types
+    or None for any type.
     '''
     
+    __slots__ = ('name', 'timestamp', 'tail', 'head', 'edge_type')
+    
     def __init__(self, name, timestamp, tail, head, edge_type=None):
         self.name = name
         self.timestamp = int(timestamp)
@@ -83,49 +290,204 @@ class Graph():
         graph.save('path/to/file.txt')
         # load another Graph
         graph2 = Graph(efile='path/to/file.txt')
+      or, using the binary format, which is much faster to load :
+        graph.save_binary('path/to/file.bin')
+        graph2 = Graph(bfile='path/to/file.bin')
+    
+    The categories of the vertices of a motif can be given as a list of
+    Vertices, the other vertices being created from the edges :
+        motif = Graph(elist=edgelist, vlist=[Vertex(1, 'user')])
+    
+    With a retention, the Graph is windowed : it only keeps the edges at most
+    retention older than the latest edge added, and the vertices that still
+    have edges, so that a long-running process ingesting a stream of edges
+    (added in timestamp order) holds a bounded amount of memory. Matches
+    spanning at most d <= retention are not lost. Adding and evicting edges
+    is cheap, but the first search after a change rebuilds the arrays from
+    the whole window.
+        graph = Graph(retention=24 * 3600 * 1000)
+        graph.add_edge(...)
     
     Args:
     - elist (list of Edges): list of Edge objects (defaults to None);
-    - efile (path to a graph file): path to a graph file to generate the graph.
+    - efile (path to a graph file): path to a graph file to generate the graph;
+    - bfile (path to a binary graph file): path to a binary graph file to
+    generate the graph;
+    - vlist (list of Vertices): Vertex objects to create before the ones of
+    the edges, with their category (defaults to None);
+    - retention (number): maximum age of the edges kept, relative to the
+    latest edge (defaults to None, keep all the edges).
     '''
-    def __init__(self, elist=None, efile=None):
+    def __init__(self, elist=None, efile=None, bfile=None, vlist=None,
+                 retention=None):
         self.vertices = []
         self.edges = []
+        self._vertex_index = {} # Vertex name -> index in self.vertices
+        # Edge name -> index in self.edges, plus self._offset : the number of
+        # edges evicted from the front of the list in windowed mode.
+        self._edge_index = {}
+        self._offset = 0
+        self.retention = retention
+        self._degree = None # Vertex name -> number of edges, windowed mode
+        self._email_digests = {} # email name -> content digest, windowed mode
+        self._latest = None # Latest edge timestamp, windowed mode
         self.n = 0 # Number of edges for generating edge name
+        # Integer encoding of the (sorted) Edge list, used by the matcher :
+        # for edge i, tails[i] and heads[i] are vertex indices, timestamps[i]
+        # its timestamp and types[i] the index of its type in type_names.
+        self.tails = None
+        self.heads = None
+        self.timestamps = None
+        self.types = None
+        self.type_names = []
+        # Edges of each type, in CSR form as below, built when first needed,
+        # and motif edge type -> array of the allowed type indices.
+        self.type_ptr = None
+        self.type_edges = None
+        self._type_codes_cache = {}
+        # Index in category_names of the category of each vertex, -1 if
+        # unknown.
+        self.categories = None
+        self.category_names = []
+        # Temporal adjacency indexes, in CSR form : the edges going out of
+        # vertex v are out_edges[out_ptr[v]:out_ptr[v+1]], sorted by index
+        # (hence by timestamp). Same for in_edges and for the (tail, head)
+        # pairs, pair_keys holding the sorted tail * len(vertices) + head keys.
+        self.out_ptr = None
+        self.out_edges = None
+        self.in_ptr = None
+        self.in_edges = None
+        self.pair_keys = None
+        self.pair_ptr = None
+        self.pair_edges = None
+        self._stale = True # True when the arrays don't reflect self.edges
+        # For a subgraph, the Graph and the indices of its edges in it
+        self._source = None
+        # When the Edge objects are not created (self._edges is None), their
+        # names are either given by _edge_names, the encoded names read from
+        # a binary file, or generated from the type and the number of each
+        # edge in _edge_seqs.
+        self._edge_names = None
+        self._edge_seqs = None
+        # Per-user index (see build_user_index) : the edges attributed to
+        # user vertex u are user_edges[user_ptr[u]:user_ptr[u+1]], and
+        # _user_arrays holds the edge arrays in this order.
+        self.user_ptr = None
+        self.user_edges = None
+        self._user_arrays = None
         self._email_dict = {} 
         # A dictionnary for storing the email content : since we lack an email 
         # identifier in the log data, we assume two emails to be the same if the
-        # email content matches.
+        # email content matches. Only a digest of the content is kept, as key,
+        # the value being the email name.
+        self._n_emails = 0
         if efile:
-            self.read_graph_file(g_file)
+            self.read_graph_file(efile)
+        if bfile:
+            self.read_binary_file(bfile)
+        if vlist:
+            for v in vlist:
+                self.add_vertex(v.name, v.category)
         if elist:
             self.edges = copy(elist) # is it useful to copy ?
             self.n = len(self.edges)
             self.create_vertices()
-        self.eGtrace = []
-        self.eMtrace = []
-        self.estacktrace = []
-        self.sort_edges()
+        # Trace of the last search done with trace=True : for each step, the
+        # edge of self found by find_next_match, the edge of the motif it was
+        # matched against and the depth of the edge stack.
+        self.eGtrace = array('q')
+        self.eMtrace = array('q')
+        self.estacktrace = array('q')
+        if self._stale:
+            self.sort_edges()
+            self.build_arrays()
+        if retention is not None:
+            self._start_window()
     
     def __repr__(self):
-        return "Graph: %s vertices, %s edges" % (len(self.vertices), len(self.edges))
+        if self._edges is not None: # may have been changed directly
+            ne = len(self._edges)
+        else:
+            ne = len(self.timestamps)
+        return "Graph: %s vertices, %s edges" % (len(self.vertices), ne)
+    
+    @property
+    def edges(self):
+        # Graphs read from a binary file only create their Edge objects when
+        # they are first needed.
+        if self._edges is None:
+            self._edges = self._edges_from_arrays()
+        return self._edges
+    
+    @edges.setter
+    def edges(self, elist):
+        self._edges = elist
+        if elist is not None:
+            # the arrays and the name index describe the previous Edges
+            self._stale = True
+            self._edge_index = None
     
     def get_vertex(self, name):
         """
         Get Vertex by name.
         """
-        for v in self.vertices:
-            if v.name == name:
-                return v
+        i = self._vertex_index.get(name)
+        if i is not None:
+            return self.vertices[i]
     
     def get_edge(self, name):
         """
         Get Edge by name.
         """
-        for e in self.edges:
-            if e.name == name:
-                return e
-                
+        if self._edge_index is None:
+            self._index_edges()
+        i = self._edge_index.get(name)
+        if i is not None:
+            return self._edge_at(i - self._offset)
+    
+    def _index_edges(self):
+        """
+        Rebuilds the Edge name -> index dictionnary, to be called whenever the
+        order of the Edge list changes.
+        """
+        self._edge_index = {name: self._offset + i
+                            for i, name in enumerate(self._edge_name_list())}
+    
+    def _edge_name_list(self):
+        """
+        Returns the list of the names of the edges, without creating the Edge
+        objects.
+        """
+        if self._edges is not None:
+            return [e.name for e in self._edges]
+        if self._source is not None:
+            graph, index = self._source
+            names = graph._edge_name_list()
+            return [names[i] for i in index.tolist()]
+        if self._edge_seqs is not None:
+            return [self.type_names[c] + str(seq) for c, seq
+                    in zip(self.types.tolist(), self._edge_seqs.tolist())]
+        return _decode_strings(*self._edge_names)
+    
+    def _edge_at(self, i):
+        """
+        Returns the i-th Edge, only creating this one if the Edge objects
+        don't exist.
+        """
+        if self._edges is not None:
+            return self._edges[i]
+        if self._source is not None:
+            graph, index = self._source
+            return graph._edge_at(int(index[i]))
+        if self._edge_seqs is not None:
+            name = self.type_names[self.types[i]] + str(self._edge_seqs[i])
+        else:
+            data, offsets = self._edge_names
+            name = bytes(data[offsets[i]:offsets[i+1]]).decode('utf-8')
+        return Edge(name, self.timestamps[i], self.vertices[self.tails[i]].name,
+                    self.vertices[self.heads[i]].name,
+                    self.type_names[self.types[i]])
+    
     def create_vertices(self):
         """
         Once all Edges are created, we create the list of Vertices.
@@ -138,29 +500,117 @@ class Graph():
         """
         Get index of Vertex in the Vertex list by name.
         """
-        for i, v in enumerate(self.vertices):
-            if v.name == name:
-                return i
+        return self._vertex_index.get(name)
     
-    def add_vertex(self, vertex_name):
+    def add_vertex(self, vertex_name, category=None):
         """
-        Function for adding a new Vertex, if it doesn't already exist.
+        Function for adding a new Vertex, if it doesn't already exist. The
+        category of an existing Vertex is set if it was unknown.
         """
         # Check if vertex already exists
-        for v in self.vertices:
-            if v.name == vertex_name:
-                return
-        vertex = Vertex(vertex_name)
+        i = self._vertex_index.get(vertex_name)
+        if i is not None:
+            if category is not None and self.vertices[i].category is None:
+                self.vertices[i].category = category
+                self._stale = True
+            return
+        vertex = Vertex(vertex_name, category)
+        self._vertex_index[vertex_name] = len(self.vertices)
         self.vertices.append(vertex)
+        self._stale = True # the arrays are indexed by vertex
     
     def add_edge(self, name, timestamp, tail, head, edge_type):
         """
-        Adds an Edge to the Edge list.
+        Adds an Edge to the Edge list. The tail and head names are interned, so
+        that all the Edges of a vertex share one string.
         """
+        if type(tail) is str:
+            tail = sys.intern(tail)
+        if type(head) is str:
+            head = sys.intern(head)
         # We assume each edge creation is unique, to save time at edge creation
         edge = Edge(name, timestamp, tail, head, edge_type)
+        if self._edge_index is None:
+            self._index_edges()
+        self._edge_index[name] = self._offset + len(self.edges)
         self.edges.append(edge)
         self.n += 1
+        self._stale = True
+        if self._degree is not None:
+            # windowed : the vertices are created with their edges
+            for v in (edge.tail, edge.head):
+                self.add_vertex(v)
+                self._degree[v] = self._degree.get(v, 0) + 1
+            if self._latest is None or edge.timestamp > self._latest:
+                self._latest = edge.timestamp
+            self.evict()
+    
+    def _start_window(self):
+        """
+        Switches the Graph to windowed mode : the Edges are kept in a deque,
+        from which the oldest ones are evicted.
+        """
+        self.edges = deque(self.edges)
+        if self._edge_index is None:
+            self._index_edges()
+        self._degree = {}
+        for e in self.edges:
+            self._degree[e.tail] = self._degree.get(e.tail, 0) + 1
+            self._degree[e.head] = self._degree.get(e.head, 0) + 1
+        if self.edges:
+            self._latest = max(e.timestamp for e in self.edges)
+        self.evict()
+    
+    def evict(self, horizon=None):
+        """
+        Drops the Edges older than horizon, and the Vertices left without any
+        Edge. The Edge list, the name index and the Vertices are updated in
+        O(1) per evicted Edge, but the arrays used by the matchers are then
+        rebuilt from all the Edges of the window by the next search, as after
+        add_edge. Returns the number of evicted Edges. Only for windowed
+        Graphs, where it is done by add_edge.
+        
+        Args:
+        - horizon (number): timestamp of the oldest edges kept (defaults to
+        the latest timestamp minus the retention).
+        """
+        if self._degree is None:
+            raise ValueError('evict needs a Graph created with a retention')
+        if horizon is None:
+            if self._latest is None:
+                return 0
+            horizon = self._latest - self.retention
+        if self._edge_index is None:
+            self._index_edges()
+        evicted = 0
+        while self.edges and self.edges[0].timestamp < horizon:
+            e = self.edges.popleft()
+            del self._edge_index[e.name]
+            self._offset += 1
+            evicted += 1
+            for v in (e.tail, e.head):
+                self._degree[v] -= 1
+                if self._degree[v] == 0:
+                    self._remove_vertex(v)
+        if evicted:
+            self._stale = True
+        return evicted
+    
+    def _remove_vertex(self, name):
+        """
+        Removes a Vertex, moving the last Vertex in its place.
+        """
+        del self._degree[name]
+        i = self._vertex_index.pop(name)
+        last = self.vertices.pop()
+        if i < len(self.vertices):
+            self.vertices[i] = last
+            self._vertex_index[last.name] = i
+        # an email that is gone may not be matched by content anymore
+        digest = self._email_digests.pop(name, None)
+        if digest is not None:
+            del self._email_dict[digest]
+        self._stale = True
     
     def sort_edges(self):
         """
@@ -172,24 +622,195 @@ class Graph():
         except:
             keyfun = lambda e: e.timestamp
             
-        self.edges.sort(key=keyfun)
+        if self._degree is None:
+            self.edges.sort(key=keyfun)
+        else:
+            self.edges = deque(sorted(self.edges, key=keyfun))
+        self._index_edges()
+        self._stale = True
+    
+    def build_arrays(self):
+        """
+        Builds the integer arrays (tails, heads, timestamps, types) describing
+        the Edge list. Must be called once the Edges are sorted and the
+        Vertices created ; the matching functions rebuild them if Edges were
+        added (by add_edge, or to the list itself) or removed, or if a new
+        Edge list was assigned, since. Other changes made to the Edge objects
+        or to the order of the list in place need a call to build_arrays.
+        """
+        vindex = self._vertex_index
+        tindex = {}
+        self.type_names = []
+        types = []
+        for e in self.edges:
+            edge_type = e.edge_type
+            if isinstance(edge_type, (set, list, tuple)): # motif edge
+                edge_type = frozenset(edge_type)
+            code = tindex.get(edge_type)
+            if code is None:
+                code = tindex[edge_type] = len(self.type_names)
+                self.type_names.append(edge_type)
+            types.append(code)
+        self.tails = np.array([vindex[e.tail] for e in self.edges], dtype=np.int32)
+        self.heads = np.array([vindex[e.head] for e in self.edges], dtype=np.int32)
+        self.timestamps = np.array([e.timestamp for e in self.edges], dtype=np.int64)
+        self.types = np.array(types, dtype=np.int32)
+        self.category_names, self.categories = self._vertex_categories()
+        self._build_adjacency()
+        self._stale = False
+        # the names are now the ones of the Edge objects
+        self._edge_names = None
+        self._edge_seqs = None
+    
+    def _vertex_categories(self):
+        """
+        Returns the list of the categories of the Vertices, and the array of
+        the index in this list of the category of each Vertex (-1 if it is
+        unknown).
+        """
+        cindex = {}
+        names = []
+        categories = []
+        for v in self.vertices:
+            if v.category is None:
+                categories.append(-1)
+                continue
+            code = cindex.get(v.category)
+            if code is None:
+                code = cindex[v.category] = len(names)
+                names.append(v.category)
+            categories.append(code)
+        return names, np.array(categories, dtype=np.int32)
+    
+    def _build_adjacency(self):
+        """
+        Builds the out-edge, in-edge and (tail, head) pair indexes from the
+        edge arrays.
+        """
+        nv = len(self.vertices)
+        def csr(keys, nkeys):
+            # stable sort keeps edges of a same key in timestamp order
+            order = np.argsort(keys, kind='stable')
+            ptr = np.zeros(nkeys + 1, dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=nkeys), out=ptr[1:])
+            return ptr, order.astype(np.int64)
+        self.out_ptr, self.out_edges = csr(self.tails, nv)
+        self.in_ptr, self.in_edges = csr(self.heads, nv)
+        keys = self.tails.astype(np.int64) * nv + self.heads
+        order = np.argsort(keys, kind='stable')
+        self.pair_keys, starts = np.unique(keys[order], return_index=True)
+        self.pair_ptr = np.append(starts, len(keys)).astype(np.int64)
+        self.pair_edges = order.astype(np.int64)
+        self.type_ptr = None
+        self.type_edges = None
+        self._type_codes_cache = {}
+        self.user_ptr = None
+        self.user_edges = None
+        self._user_arrays = None
+    
+    def _type_index(self):
+        """
+        Returns the type_ptr and type_edges index of the edges of each type,
+        building it if needed.
+        """
+        if self.type_ptr is None:
+            nt = len(self.type_names)
+            order = np.argsort(self.types, kind='stable')
+            ptr = np.zeros(nt + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.types, minlength=nt), out=ptr[1:])
+            self.type_ptr, self.type_edges = ptr, order.astype(np.int64)
+        return self.type_ptr, self.type_edges
+    
+    def _type_codes(self, edge_type):
+        """
+        Returns the sorted array of the indices in self.type_names of the
+        types allowed by the type of a motif edge, or None if any type is.
+        """
+        if edge_type not in self._type_codes_cache:
+            allowed = _motif_types(edge_type)
+            if allowed is not None:
+                allowed = np.array([c for c, name in enumerate(self.type_names)
+                                    if name in allowed], dtype=np.int32)
+            self._type_codes_cache[edge_type] = allowed
+        return self._type_codes_cache[edge_type]
+    
+    def _category_code(self, category):
+        """
+        Returns the index in self.category_names of the category a motif
+        vertex requires, -2 if no vertex has it, or None for any category.
+        """
+        if category is None:
+            return None
+        if category in self.category_names:
+            return self.category_names.index(category)
+        return -2
+    
+    def _pair_range(self, u, v):
+        """
+        Returns the bounds of the edges from u to v in self.pair_edges.
+        """
+        k = u * len(self.vertices) + v
+        p = int(np.searchsorted(self.pair_keys, k))
+        if p < len(self.pair_keys) and self.pair_keys[p] == k:
+            return self.pair_ptr[p], self.pair_ptr[p+1]
+        return 0, 0
+    
+    def _check_arrays(self):
+        if not self._stale and self._edges is not None \
+                and len(self._edges) != len(self.timestamps):
+            # Edges appended to or removed from the list itself
+            self._stale = True
+            self._edge_index = None
+        if self._stale:
+            self.build_arrays()
     
     def _generate_email_name(self, typ, row):
         """
         Generates email name when reading data from csv.
         """
         if typ == 'email':
-            # search in the email dict for matching email content
-            for name, content in self._email_dict.items():
-                if row['email_content'] == content:
-                    return name
-            # not found : create new email
-            name = 'email' + str(len(self._email_dict))
-            self._email_dict[name] = row['email_content']
-            return name
+            return self._email_name(row['email_content'])
         else:
             raise TypeError('type must be email')
     
+    def _email_name(self, email_content):
+        """
+        Returns the name of the email with the given content, creating a new
+        one if this content was never seen.
+        """
+        name = 'email' + str(self._n_emails)
+        if pd.isna(email_content): # null content, never equal to another one
+            self._n_emails += 1
+            return name
+        # search in the email dict for matching email content
+        digest = hashlib.blake2b(str(email_content).encode('utf-8'),
+                                 digest_size=16).digest()
+        if digest in self._email_dict:
+            return self._email_dict[digest]
+        # not found : create new email
+        self._email_dict[digest] = name
+        if self._degree is not None:
+            self._email_digests[name] = digest
+        self._n_emails += 1
+        return name
+    
+    def _email_names(self, contents):
+        """
+        Returns the email names for an array of email contents, in order, as
+        successive calls to _email_name would.
+        """
+        codes, uniques = pd.factorize(contents)
+        names = [None] * len(uniques)
+        result = []
+        for c, content in zip(codes.tolist(), contents):
+            if c < 0: # null content, never equal to a previous one
+                result.append(self._email_name(content))
+            else:
+                if names[c] is None:
+                    names[c] = self._email_name(uniques[c])
+                result.append(names[c])
+        return result
+    
     def _generate_edge_name(self, typ):
         """
         Generates Edge name when reading data from csv.
@@ -204,6 +825,12 @@ class Graph():
         elif np.isnan(val):
             return True
     
+    def _notnull(self, col):
+        """
+        Vectorized negation of _isnull over a dataframe column.
+        """
+        return (col.notna() & (col != '')).to_numpy()
+    
     def _parse_row(self, row):
         """
         Parses a row from the Pandes dataframe generated from reading the csv.
@@ -265,6 +892,243 @@ class Graph():
             edge_name = self._generate_edge_name('Attach')
             self.add_edge(edge_name, edge_time, edge_tail, edge_head, edge_type)
     
+    def _frame_edges(self, df):
+        """
+        Computes the edges of a whole dataframe read from the csv, working on
+        the columns instead of the rows. The edges are the ones _parse_row
+        would create, in the same order, and are returned as arrays of types,
+        timestamps, tails, heads, and categories of the tails and heads. The
+        email names are generated.
+        
+        Args:
+        - df (Pandas DataFrame): the dataframe to parse.
+        """
+        nrows = len(df)
+        # index in ACTIVITIES of the activity of each row, -1 if none : the
+        # first activity present wins, as in _parse_row
+        kind = np.full(nrows, -1)
+        for k in reversed(range(len(ACTIVITIES))):
+            kind[self._notnull(df[ACTIVITIES[k][0]])] = k
+        types = np.empty(nrows, dtype=object)
+        tails = np.empty(nrows, dtype=object)
+        heads = np.empty(nrows, dtype=object)
+        tail_cats = np.empty(nrows, dtype=object)
+        head_cats = np.empty(nrows, dtype=object)
+        for k, (col, tail_col, head_col) in enumerate(ACTIVITIES):
+            mask = kind == k
+            types[mask] = df[col].to_numpy()[mask]
+            tails[mask] = df[tail_col].to_numpy()[mask]
+            tail_cats[mask] = COLUMN_CATEGORIES[tail_col]
+            if head_col is not None:
+                heads[mask] = df[head_col].to_numpy()[mask]
+                head_cats[mask] = COLUMN_CATEGORIES[head_col]
+        email = kind == 0
+        heads[email] = self._email_names(df['email_content'].to_numpy()[email])
+        head_cats[email] = 'email'
+        timestamps = df['date'].to_numpy()
+        # Attach edges, created before the Send edge of their row
+        attach = email & (types == 'Send') \
+            & self._notnull(df['email_attachments'])
+        files = df['email_attachments'][attach].astype(str).str.split(';')
+        nattach = np.zeros(nrows, dtype=np.int64)
+        nattach[attach] = files.str.len().to_numpy()
+        files = files.explode().str.replace(r'\(.*\)', '', regex=True)
+        # position of the first edge of each row in the sequence of created
+        # edges, the Send edge coming after its Attach edges
+        count = (kind >= 0) + nattach
+        first = np.cumsum(count) - count
+        nedges = int(count.sum())
+        edge_types = np.empty(nedges, dtype=object)
+        edge_times = np.empty(nedges, dtype=np.int64)
+        edge_tails = np.empty(nedges, dtype=object)
+        edge_heads = np.empty(nedges, dtype=object)
+        edge_tail_cats = np.empty(nedges, dtype=object)
+        edge_head_cats = np.empty(nedges, dtype=object)
+        rows = np.flatnonzero(kind >= 0)
+        pos = first[rows] + nattach[rows]
+        edge_types[pos] = types[rows]
+        edge_times[pos] = timestamps[rows]
+        edge_tails[pos] = tails[rows]
+        edge_heads[pos] = heads[rows]
+        edge_tail_cats[pos] = tail_cats[rows]
+        edge_head_cats[pos] = head_cats[rows]
+        rows = np.repeat(np.flatnonzero(attach), nattach[attach])
+        rank = np.arange(len(rows)) - np.repeat(
+            np.cumsum(nattach[attach]) - nattach[attach], nattach[attach])
+        pos = first[rows] + rank
+        edge_types[pos] = 'Attach'
+        edge_times[pos] = timestamps[rows]
+        edge_tails[pos] = files.to_numpy()
+        edge_heads[pos] = heads[rows]
+        edge_tail_cats[pos] = 'file'
+        edge_head_cats[pos] = 'email'
+        return edge_types, edge_times, edge_tails, edge_heads, \
+            edge_tail_cats, edge_head_cats
+    
+    def _parse_frame(self, df):
+        """
+        Parses a whole dataframe read from the csv at once. This creates the
+        same Edges, with the same names and in the same order, as calling
+        _parse_row on each row.
+        
+        Args:
+        - df (Pandas DataFrame): the dataframe to parse.
+        """
+        edge_types, edge_times, edge_tails, edge_heads, tail_cats, head_cats \
+            = self._frame_edges(df)
+        for typ, time, tail, head, tail_cat, head_cat in zip(
+                edge_types, edge_times.tolist(), edge_tails, edge_heads,
+                tail_cats, head_cats):
+            self.add_edge(self._generate_edge_name(typ), time, tail, head, typ)
+            self.add_vertex(tail, tail_cat)
+            self.add_vertex(head, head_cat)
+    
+    def _vertex_ids(self, names, categories):
+        """
+        Returns the indices of the Vertices with the given names, creating the
+        missing ones with the given categories.
+        """
+        codes, uniques = pd.factorize(names, use_na_sentinel=False)
+        first = np.zeros(len(uniques), dtype=np.int64)
+        first[codes[::-1]] = np.arange(len(codes))[::-1]
+        ids = np.empty(len(uniques), dtype=np.int32)
+        for i, name in enumerate(uniques):
+            self.add_vertex(name, categories[first[i]])
+            ids[i] = self._vertex_index[name]
+        return ids[codes]
+    
+    def read_data_stream(self, data_path, path, chunksize=100000):
+        """
+        Reads a csv file of CERT data that may not fit in memory, and writes
+        the graph to a binary graph file, which is then read (see
+        read_binary_file). The edges are the same as with read_data.
+        
+        The csv is read by chunks of rows ; the edges of each chunk are sorted
+        by timestamp and saved as a temporary run, and the runs are then
+        merged into the graph file. Memory use depends on the chunk size and
+        on the number of vertices, not on the size of the csv.
+        
+        Args:
+        - data_path (str): valid path to the csv file;
+        - path (str): path of the binary graph file to write;
+        - chunksize (int): number of rows read at once.
+        """
+        tmpdir = tempfile.mkdtemp(dir=op.dirname(op.abspath(path)))
+        try:
+            self._write_stream(data_path, path, chunksize, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.read_binary_file(path)
+    
+    def _write_stream(self, data_path, path, chunksize, tmpdir):
+        """
+        Does the work of read_data_stream, using tmpdir for the runs.
+        """
+        runs = []
+        type_index = {}
+        pairs = np.zeros(0, dtype=np.int64) # tail << 32 | head
+        name_size = 0
+        print('reading data ...')
+        for df in tqdm(pd.read_csv(data_path, chunksize=chunksize)):
+            types, times, tails, heads, tail_cats, head_cats \
+                = self._frame_edges(df)
+            run = np.empty(len(types), dtype=RUN_DTYPE)
+            run['timestamp'] = times
+            run['seq'] = np.arange(self.n, self.n + len(run))
+            run['tail'] = self._vertex_ids(tails, tail_cats)
+            run['head'] = self._vertex_ids(heads, head_cats)
+            run['type'] = [type_index.setdefault(t, len(type_index))
+                           for t in types]
+            self.n += len(run)
+            # the names are written as utf-8, see below
+            name_size += sum(len((t + str(seq)).encode('utf-8'))
+                             for t, seq in zip(types, run['seq'].tolist()))
+            pairs = np.union1d(pairs, (run['tail'].astype(np.int64) << 32)
+                                      | run['head'])
+            runs.append(op.join(tmpdir, 'run%s.npy' % len(runs)))
+            np.save(runs[-1], run[np.argsort(run['timestamp'], kind='stable')])
+        print('merging edges ...')
+        runs = [np.load(run, mmap_mode='r') for run in runs]
+        nv = len(self.vertices)
+        ne = sum(len(run) for run in runs)
+        pair_keys = (pairs >> 32) * nv + (pairs & 0xffffffff)
+        type_names = list(type_index)
+        category_names, categories = self._vertex_categories()
+        vertex_names, vertex_offsets = _encode_strings(
+            [v.name for v in self.vertices])
+        arrays = [
+            ('timestamps', np.int64, (ne,)),
+            ('tails', np.int32, (ne,)),
+            ('heads', np.int32, (ne,)),
+            ('types', np.int32, (ne,)),
+            ('out_ptr', np.int64, (nv + 1,)),
+            ('out_edges', np.int64, (ne,)),
+            ('in_ptr', np.int64, (nv + 1,)),
+            ('in_edges', np.int64, (ne,)),
+            ('pair_keys', np.int64, (len(pair_keys),)),
+            ('pair_ptr', np.int64, (len(pair_keys) + 1,)),
+            ('pair_edges', np.int64, (ne,)),
+            ('vertex_names', np.uint8, vertex_names.shape),
+            ('vertex_offsets', np.int64, (nv + 1,)),
+            ('categories', np.int32, (nv,)),
+            ('edge_names', np.uint8, (name_size,)),
+            ('edge_offsets', np.int64, (ne + 1,))]
+        header = {'n_vertices': nv, 'n_edges': ne, 'type_names': type_names,
+                  'category_names': category_names}
+        offsets = _create_binary_file(path, arrays, header)
+        out = {name: _map_binary_array(path, dtype, shape, offsets[name], 'r+')
+               for name, dtype, shape in arrays}
+        out['vertex_names'][:] = vertex_names
+        out['vertex_offsets'][:] = vertex_offsets
+        out['categories'][:] = categories
+        out['pair_keys'][:] = pair_keys
+        out_count = np.zeros(nv, dtype=np.int64)
+        in_count = np.zeros(nv, dtype=np.int64)
+        pair_count = np.zeros(len(pair_keys), dtype=np.int64)
+        i = 0
+        name_pos = 0
+        for edges in _merge_runs(runs, max(1, chunksize // max(1, len(runs)))):
+            j = i + len(edges)
+            out['timestamps'][i:j] = edges['timestamp']
+            out['tails'][i:j] = edges['tail']
+            out['heads'][i:j] = edges['head']
+            out['types'][i:j] = edges['type']
+            names = [(type_names[c] + str(seq)).encode('utf-8')
+                     for c, seq in zip(edges['type'].tolist(),
+                                       edges['seq'].tolist())]
+            data = np.frombuffer(b''.join(names), dtype=np.uint8)
+            out['edge_names'][name_pos:name_pos + len(data)] = data
+            out['edge_offsets'][i+1:j+1] = name_pos + np.cumsum(
+                [len(name) for name in names], dtype=np.int64)
+            name_pos += len(data)
+            out_count += np.bincount(edges['tail'], minlength=nv)
+            in_count += np.bincount(edges['head'], minlength=nv)
+            pair_count += np.bincount(np.searchsorted(pair_keys,
+                edges['tail'].astype(np.int64) * nv + edges['head']),
+                minlength=len(pair_keys))
+            i = j
+        # adjacency indexes, filled by chunks of edges with a counting sort
+        for name, count in [('out_ptr', out_count), ('in_ptr', in_count),
+                            ('pair_ptr', pair_count)]:
+            out[name][0] = 0
+            np.cumsum(count, out=out[name][1:])
+        out_next = np.array(out['out_ptr'][:-1])
+        in_next = np.array(out['in_ptr'][:-1])
+        pair_next = np.array(out['pair_ptr'][:-1])
+        for i in range(0, ne, chunksize):
+            edges = np.arange(i, min(i + chunksize, ne))
+            tails = np.array(out['tails'][i:i + chunksize])
+            heads = np.array(out['heads'][i:i + chunksize])
+            _scatter(tails, edges, out_next, out['out_edges'])
+            _scatter(heads, edges, in_next, out['in_edges'])
+            _scatter(np.searchsorted(pair_keys,
+                                     tails.astype(np.int64) * nv + heads),
+                     edges, pair_next, out['pair_edges'])
+        for a in out.values():
+            if isinstance(a, np.memmap):
+                a.flush()
+        print('done')
+    
     def read_data(self, data_path):
         """
         Reads a csv file of CERT data.
@@ -274,12 +1138,53 @@ class Graph():
         """
         df = pd.read_csv(data_path)
         print('reading data ...')
-        for idx, row in tqdm(df.iterrows()):
-            self._parse_row(row)
-        print('sorting edges ...')
-        self.sort_edges
-        print('done')
-        self.create_vertices()
+        if self.n or self._degree is not None:
+            # adding to existing or windowed Edges
+            self._parse_frame(df)
+            print('sorting edges ...')
+            self.sort_edges()
+            print('done')
+            self.create_vertices()
+            self.build_arrays()
+        else:
+            self._read_frame(df)
+            print('done')
+    
+    def _read_frame(self, df):
+        """
+        Reads the edges of a whole dataframe directly into the edge arrays :
+        the Edges are the ones _parse_frame would create, sorted, but the
+        Edge objects are only created when self.edges is used.
+        
+        Args:
+        - df (Pandas DataFrame): the dataframe to parse.
+        """
+        types, times, tails, heads, tail_cats, head_cats = \
+            self._frame_edges(df)
+        ne = len(types)
+        # vertices created in the same order as by _parse_frame
+        names = np.empty(2 * ne, dtype=object)
+        names[0::2] = tails
+        names[1::2] = heads
+        categories = np.empty(2 * ne, dtype=object)
+        categories[0::2] = tail_cats
+        categories[1::2] = head_cats
+        ids = self._vertex_ids(names, categories)
+        order = np.argsort(times, kind='stable')
+        codes, type_names = pd.factorize(types[order])
+        self.timestamps = times[order].astype(np.int64)
+        self.tails = ids[0::2][order]
+        self.heads = ids[1::2][order]
+        self.types = codes.astype(np.int32)
+        self.type_names = list(type_names)
+        self._edge_seqs = np.arange(self.n, self.n + ne)[order]
+        self.n += ne
+        self.edges = None
+        self._edge_index = None
+        self._edge_names = None
+        self.category_names, self.categories = self._vertex_categories()
+        self._build_adjacency()
+        self._stale = False
     """
     def temporal_match(self, M, delta):
         # Initialize necessary variables :
@@ -415,30 +1320,198 @@ class Graph():
     def save(self, path):
         """
         Function for saving the graph data to a file after it has been built.
+        The vertices are written once, as a table of names and categories,
+        and each edge line holds the indices of its tail and head in this
+        table :
+            #vertices,<number of vertices>
+            <vertex name>,<category>
+            ...
+            #edges,<number of edges>
+            <edge name>,<timestamp>,<tail index>,<head index>,<type>
+            ...
         
         Args :
         - path (str) : a valid path to save the graph.
         """
+        self._check_arrays()
         with open(path, 'w') as f:
-            for e in self.edges:
-                f.write(e.elements_as_str())
-                f.write("\n")
+            f.write('%s,%s\n' % (TEXT_VERTICES, len(self.vertices)))
+            f.writelines('%s,%s\n' % (v.name, v.category or '')
+                         for v in self.vertices)
+            f.write('%s,%s\n' % (TEXT_EDGES, len(self.timestamps)))
+            type_names = self.type_names
+            f.writelines('%s,%s,%s,%s,%s\n' % (name, t, u, v, type_names[c])
+                         for name, t, u, v, c in zip(self._edge_name_list(),
+                                                     self.timestamps.tolist(),
+                                                     self.tails.tolist(),
+                                                     self.heads.tolist(),
+                                                     self.types.tolist()))
+    
+    def save_binary(self, path):
+        """
+        Saves the graph in the binary format : the edge arrays, the adjacency
+        indexes and the vertex and edge names are written as raw arrays, so
+        that read_binary_file can map them in memory instead of parsing them.
+        
+        Args :
+        - path (str) : a valid path to save the graph.
+        """
+        self._check_arrays()
+        arrays = {}
+        for name in ['timestamps', 'tails', 'heads', 'types', 'categories',
+                     'out_ptr', 'out_edges', 'in_ptr', 'in_edges', 'pair_keys',
+                     'pair_ptr', 'pair_edges']:
+            arrays[name] = np.ascontiguousarray(getattr(self, name))
+        arrays['vertex_names'], arrays['vertex_offsets'] = _encode_strings(
+            [v.name for v in self.vertices])
+        arrays['edge_names'], arrays['edge_offsets'] = _encode_strings(
+            self._edge_name_list())
+        header = {
+            'n_vertices': len(self.vertices),
+            'n_edges': len(self.timestamps),
+            'type_names': self.type_names,
+            'category_names': self.category_names}
+        offsets = _create_binary_file(
+            path, [(name, a.dtype, a.shape) for name, a in arrays.items()],
+            header)
+        with open(path, 'r+b') as f:
+            for name, a in arrays.items():
+                f.seek(offsets[name])
+                f.write(a.tobytes())
+    
+    def read_binary_file(self, path):
+        """
+        Reads a graph from a file written by save_binary. The edge arrays and
+        adjacency indexes are memory-mapped (read-only), so loading is fast and
+        processes reading the same file share its pages ; the Edge objects are
+        only created if self.edges is used.
+        
+        Args:
+        path (str) : a valid path to a binary graph file
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise ValueError('%s is not a binary graph file' % path)
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size).decode('utf-8'))
+        if header['version'] != BINARY_VERSION:
+            raise ValueError('unsupported binary graph version %s'
+                             % header['version'])
+        start = _align(len(BINARY_MAGIC) + 8 + size)
+        arrays = {}
+        for name, desc in header['arrays'].items():
+            arrays[name] = _map_binary_array(path, np.dtype(desc['dtype']),
+                                             tuple(desc['shape']),
+                                             start + desc['offset'])
+        self.vertices = []
+        self._vertex_index = {}
+        # files written before the categories were added have none
+        self.category_names = header.get('category_names', [])
+        if 'categories' not in arrays:
+            arrays['categories'] = np.full(header['n_vertices'], -1,
+                                           dtype=np.int32)
+        names = _decode_strings(arrays.pop('vertex_names'),
+                                arrays.pop('vertex_offsets'))
+        for name, c in zip(names, arrays['categories'].tolist()):
+            self.add_vertex(name, self.category_names[c] if c >= 0 else None)
+        self._edge_names = (arrays.pop('edge_names'),
+                            arrays.pop('edge_offsets'))
+        self._edge_seqs = None
+        for name, a in arrays.items():
+            setattr(self, name, a)
+        self.type_ptr = None
+        self.type_edges = None
+        self._type_codes_cache = {}
+        self.type_names = header['type_names']
+        self.n = header['n_edges']
+        self.edges = None
+        self._edge_index = None
+        self._stale = False
+    
+    def _edges_from_arrays(self):
+        """
+        Creates the Edge list of a graph whose Edge objects were not created
+        (read from a binary file, from a csv, or a subgraph).
+        """
+        if self._source is not None:
+            graph, index = self._source
+            return [graph._edge_at(i) for i in index.tolist()]
+        names = self._edge_name_list()
+        vnames = [v.name for v in self.vertices]
+        return [Edge(name, t, vnames[u], vnames[v], self.type_names[c])
+                for name, t, u, v, c in zip(names,
+                                            self.timestamps.tolist(),
+                                            self.tails.tolist(),
+                                            self.heads.tolist(),
+                                            self.types.tolist())]
     
     def read_graph_file(self, path):
         """
         Reads a graph directly from file.
-        Fills the lists of edges from the file.
+        Fills the lists of edges from the file. Files written by save start
+        with the vertex table, and are read directly into the edge arrays ;
+        files written before have one line per edge with the names of its
+        tail and head (and their categories, if any).
         
         Args:
         path (str) : a valid path to a graph file
         """
         with open(path, 'r') as f:
+            header = f.readline().rstrip('\n').split(',')
+            if header[0] == TEXT_VERTICES:
+                self._read_tables(f, int(header[1]))
+                return
+            f.seek(0)
             for line in f:
-                self.edges.append(Edge(*line.replace('\n', '').split(',')))
+                fields = line.replace('\n', '').split(',')
+                self.add_edge(*fields[:5])
+                if len(fields) == 7: # with the vertex categories
+                    self.add_vertex(fields[2], fields[5] or None)
+                    self.add_vertex(fields[3], fields[6] or None)
         self.sort_edges()
         self.create_vertices()
+        self.build_arrays()
+    
+    def _read_tables(self, f, nv):
+        """
+        Reads the rest of a graph file written by save, after its first line,
+        given the number of vertices nv. The Edge objects are only created if
+        self.edges is used.
+        """
+        for _ in range(nv):
+            name, category = f.readline().rstrip('\n').rsplit(',', 1)
+            self.add_vertex(name, category or None)
+        header = f.readline().rstrip('\n').split(',')
+        if header[0] != TEXT_EDGES:
+            raise ValueError('%s expected after the vertices' % TEXT_EDGES)
+        ne = int(header[1])
+        columns = ['name', 'timestamp', 'tail', 'head', 'type']
+        if ne:
+            df = pd.read_csv(f, header=None, names=columns, na_filter=False,
+                             dtype={'name': str, 'timestamp': np.int64,
+                                    'tail': np.int32, 'head': np.int32,
+                                    'type': str})
+        else:
+            df = pd.DataFrame({c: [] for c in columns})
+        if len(df) != ne:
+            raise ValueError('%s edges expected, %s read' % (ne, len(df)))
+        order = np.argsort(df['timestamp'].to_numpy(), kind='stable')
+        codes, type_names = pd.factorize(df['type'].to_numpy()[order])
+        self.timestamps = df['timestamp'].to_numpy(np.int64)[order]
+        self.tails = df['tail'].to_numpy(np.int32)[order]
+        self.heads = df['head'].to_numpy(np.int32)[order]
+        self.types = codes.astype(np.int32)
+        self.type_names = list(type_names)
+        self._edge_names = _encode_strings(df['name'].to_numpy()[order].tolist())
+        self._edge_seqs = None
+        self.n = ne
+        self.edges = None
+        self._edge_index = None
+        self.category_names, self.categories = self._vertex_categories()
+        self._build_adjacency()
+        self._stale = False
     
-    def temporal_match(self, M, d):
+    def temporal_match(self, M, d, output='graph', trace=False, prune=False):
         """
         Temporal subgraph matching function.
         
@@ -446,31 +1519,334 @@ class Graph():
         - M (Graph): the temporal motif to search in the graph.
         - d (number): the maximum temporal difference between first edge and
         last edge in matched subgraphs.
+        - output (str): what to return :
+            - 'graph' (default) : the list of the matched subgraphs, as Graphs;
+            - 'edges' : the list of the matched subgraphs, as tuples of the
+            indices of their edges in self.edges, one per edge of M;
+            - 'count' : the number of matches only.
+        - trace (bool): record the search in self.eGtrace, self.eMtrace and
+        self.estacktrace (defaults to False).
+        - prune (bool): first remove the edges that can't be part of a match
+        (see prune, defaults to False).
+        """
+        if output not in ('graph', 'edges', 'count'):
+            raise ValueError("output must be 'graph', 'edges' or 'count'")
+        matches = self.iter_matches(M, d, trace=trace, prune=prune)
+        if output == 'count':
+            return sum(1 for _ in matches)
+        elif output == 'edges':
+            return list(matches)
+        return [Graph(elist=[self._edge_at(e) for e in match])
+                for match in matches]
+    
+    def _subgraph(self, index, arrays=None):
+        """
+        Returns the Graph of the edges of the given (increasing) indices : its
+        edge arrays are the ones of self taken at index (or the given ones),
+        its Vertices are the Vertex objects of self used by these edges,
+        renumbered, and its Edge objects are only created if needed.
+        """
+        self._check_arrays()
+        sub = Graph()
+        if arrays is None:
+            arrays = {name: getattr(self, name)[index]
+                      for name in ['timestamps', 'tails', 'heads', 'types']}
+        vertices, sub.tails, sub.heads = _renumber_vertices(arrays['tails'],
+                                                            arrays['heads'])
+        sub.timestamps = arrays['timestamps']
+        sub.types = arrays['types']
+        sub.vertices = [self.vertices[v] for v in vertices.tolist()]
+        sub._vertex_index = {v.name: i for i, v in enumerate(sub.vertices)}
+        sub.category_names = self.category_names
+        sub.categories = self.categories[vertices]
+        sub.type_names = self.type_names
+        sub._build_adjacency()
+        sub.n = len(index)
+        sub.edges = None
+        sub._edge_index = None
+        sub._source = (self, index)
+        sub._stale = False
+        return sub
+    
+    def build_user_index(self):
+        """
+        Builds the index of the edges of each user : the edges going out of
+        the user (logons, device connections ...), the edges going out of a
+        host, attributed to the last user who logged on or connected to the
+        host, and the Attach edges, attributed to the user of the Send edge of
+        their email. Needs the vertex categories. The index is rebuilt when
+        the edges change.
+        """
+        self._check_arrays()
+        if 'user' not in self.category_names:
+            raise ValueError('the user index needs the vertex categories')
+        ne = len(self.timestamps)
+        edges = np.arange(ne)
+        code = lambda name: self._category_code(name)
+        tail_cats = self.categories[self.tails]
+        head_cats = self.categories[self.heads]
+        owner = np.full(ne, -1, dtype=np.int64)
+        sessions = tail_cats == code('user')
+        owner[sessions] = self.tails[sessions]
+        # host edges : last user -> host edge on the same host before them
+        sessions &= head_cats == code('host')
+        host = tail_cats == code('host')
+        idx = edges[sessions | host]
+        keys = np.where(sessions, self.heads, self.tails)[idx]
+        order = np.lexsort((idx, keys))
+        idx, keys = idx[order], keys[order]
+        last = _last_in_group(keys, sessions[idx])
+        found = host[idx] & (last >= 0)
+        owner[idx[found]] = self.tails[idx[last[found]]]
+        # Attach edges : next attributed edge to the same email, the Send
+        # edge coming after its Attach edges
+        email = (head_cats == code('email')) & ((owner >= 0) | ~host)
+        idx = edges[email][::-1]
+        keys = self.heads[idx]
+        order = np.lexsort((-idx, keys))
+        idx, keys = idx[order], keys[order]
+        next_ = _last_in_group(keys, owner[idx] >= 0)
+        found = (owner[idx] < 0) & (next_ >= 0)
+        owner[idx[found]] = owner[idx[next_[found]]]
+        # CSR index by user, each user's edges in increasing order
+        attributed = edges[owner >= 0]
+        order = np.argsort(owner[attributed], kind='stable')
+        self.user_edges = attributed[order]
+        self.user_ptr = np.zeros(len(self.vertices) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owner[attributed], minlength=len(self.vertices)),
+                  out=self.user_ptr[1:])
+        self._user_arrays = {name: getattr(self, name)[self.user_edges]
+                             for name in ['timestamps', 'tails', 'heads',
+                                          'types']}
+    
+    def users(self):
+        """
+        Returns the names of the users with attributed edges, building the
+        user index if needed.
+        """
+        self._check_arrays()
+        if self.user_ptr is None:
+            self.build_user_index()
+        return [self.vertices[u].name
+                for u in np.flatnonzero(np.diff(self.user_ptr)).tolist()]
+    
+    def user_subgraph(self, name):
         """
+        Returns the Graph of the edges attributed to a user (see
+        build_user_index), building the user index if needed. Its timestamps
+        and types are views of the arrays of the index, sharing their memory,
+        and it only has the Vertices of its edges (the Vertex objects of
+        self) ; its Edge objects are only created if needed.
+        
+        Args:
+        - name (str): name of the user vertex.
+        """
+        self._check_arrays()
+        if self.user_ptr is None:
+            self.build_user_index()
+        u = self._vertex_index[name]
+        lo, hi = int(self.user_ptr[u]), int(self.user_ptr[u+1])
+        return self._subgraph(self.user_edges[lo:hi],
+                              {key: a[lo:hi]
+                               for key, a in self._user_arrays.items()})
+    
+    def _window_degrees(self, ends, mask, d):
+        """
+        Returns, for each vertex, the largest number of edges of mask it is
+        the end of (ends being self.tails or self.heads) within a time window
+        of length d.
+        """
+        degrees = np.zeros(len(self.vertices), dtype=np.int64)
+        edges = np.flatnonzero(mask)
+        if not len(edges):
+            return degrees
+        order = np.argsort(ends[edges], kind='stable')
+        edges = edges[order]
+        # edges sorted by vertex then time, keyed so that windows can't span
+        # two vertices ; a window longer than the graph holds all its edges,
+        # and d is clamped to the span so the keys can't overflow
+        t = self.timestamps[edges] - self.timestamps[0]
+        span = int(self.timestamps[-1] - self.timestamps[0])
+        d = span if d >= span else int(d)
+        width = span + d + 1
+        keys = ends[edges].astype(np.int64) * width + t
+        count = np.arange(len(keys)) \
+            - np.searchsorted(keys, keys - d, side='left') + 1
+        np.maximum.at(degrees, ends[edges], count)
+        return degrees
+    
+    def prune(self, M, d):
+        """
+        Finds the edges and vertices that can't be part of a match of the
+        temporal motif M, before the search : a vertex can only be matched to
+        a motif vertex if it has the category of the motif vertex and, within
+        a window of d, at least as many out and in edges (of each type) as
+        the motif vertex ; an edge can only be matched if its type, tail and
+        head can. This is repeated on the remaining edges until nothing
+        changes. Returns the boolean array of the edges kept, and a report
+        dictionnary with the number of edges and vertices kept and pruned.
+        
+        Args:
+        - M (Graph): the temporal motif to search in the graph.
+        - d (number): the maximum temporal difference between first edge and
+        last edge in matched subgraphs.
+        """
+        self._check_arrays()
+        M._check_arrays()
+        nv = len(self.vertices)
+        ne = len(self.timestamps)
+        motif = []
+        for eM in range(len(M.timestamps)):
+            uM, vM = M.to_vertices(eM)
+            edge_type = M.type_names[M.types[eM]]
+            allowed = self._type_codes(edge_type)
+            if allowed is None:
+                ok = np.ones(ne, dtype=bool)
+            else:
+                ok = np.isin(self.types, allowed)
+            motif.append((uM, vM, _motif_types(edge_type), ok))
+        # signatures of the motif vertices : number of out and in edges of
+        # each set of types
+        out_sig = [Counter() for _ in M.vertices]
+        in_sig = [Counter() for _ in M.vertices]
+        type_mask = {}
+        for uM, vM, types, ok in motif:
+            out_sig[uM][types] += 1
+            in_sig[vM][types] += 1
+            type_mask[types] = ok
+        candidates = []
+        for x in M.vertices:
+            code = self._category_code(x.category)
+            if code is None:
+                candidates.append(np.ones(nv, dtype=bool))
+            else:
+                candidates.append(self.categories == code)
+        keep = np.ones(ne, dtype=bool)
+        rounds = 0
+        while True:
+            rounds += 1
+            new_keep = np.zeros(ne, dtype=bool)
+            for uM, vM, types, ok in motif:
+                new_keep |= keep & ok & candidates[uM][self.tails] \
+                    & candidates[vM][self.heads]
+            changed = bool((new_keep != keep).any())
+            keep = new_keep
+            for x in range(len(M.vertices)):
+                for ends, sig in [(self.tails, out_sig[x]),
+                                  (self.heads, in_sig[x])]:
+                    if not sig:
+                        continue
+                    need = [(type_mask[types], n) for types, n in sig.items()]
+                    need.append((np.ones(ne, dtype=bool), sum(sig.values())))
+                    for ok, n in need:
+                        c = candidates[x] & (self._window_degrees(
+                            ends, keep & ok, d) >= n)
+                        changed |= bool((c != candidates[x]).any())
+                        candidates[x] = c
+            if not changed:
+                break
+        used = np.zeros(nv, dtype=bool)
+        used[self.tails[keep]] = True
+        used[self.heads[keep]] = True
+        report = {
+            'rounds': rounds,
+            'edges': int(keep.sum()),
+            'pruned_edges': ne - int(keep.sum()),
+            'vertices': int(used.sum()),
+            'pruned_vertices': nv - int(used.sum())}
+        logger.info('pruning : kept %s of %s edges and %s of %s vertices '
+                    '(%s rounds)', report['edges'], ne, report['vertices'],
+                    nv, rounds)
+        return keep, report
+    
+    def iter_matches(self, M, d, limit=None, trace=False, prune=False,
+                     start=0, stop=None):
+        """
+        Iterates over the matches of the temporal motif M, in the same order
+        as temporal_match, yielding each one as soon as it is found : the
+        search only goes as far as the caller consumes the matches. Each match
+        is a tuple of the indices of its edges in self.edges, one per edge of
+        M.
+        
+        Args:
+        - M (Graph): the temporal motif to search in the graph.
+        - d (number): the maximum temporal difference between first edge and
+        last edge in matched subgraphs.
+        - limit (int): stop after this number of matches (defaults to None,
+        no limit).
+        - trace (bool): record the search in self.eGtrace, self.eMtrace and
+        self.estacktrace (defaults to False).
+        - prune (bool): first remove the edges that can't be part of a match
+        (see prune), and search the remaining ones (defaults to False). The
+        trace is then the one of the search in the pruned graph.
+        - start, stop (int): only search the matches whose first edge index is
+        in [start, stop) (defaults to all the edges).
+        """
+        if prune:
+            keep, _ = self.prune(M, d)
+            index = np.flatnonzero(keep)
+            sub = self._subgraph(index)
+            sub_start = int(np.searchsorted(index, start))
+            sub_stop = None
+            if stop is not None:
+                sub_stop = int(np.searchsorted(index, stop))
+            index = index.tolist()
+            for match in sub.iter_matches(M, d, limit, trace, start=sub_start,
+                                          stop=sub_stop):
+                yield tuple(index[e] for e in match)
+            if trace:
+                self.eGtrace = sub.eGtrace
+                self.eMtrace = sub.eMtrace
+                self.estacktrace = sub.estacktrace
+            return
+        self._check_arrays()
+        M._check_arrays()
+        timestamps = self.timestamps.tolist()
+        tails = self.tails.tolist()
+        heads = self.heads.tolist()
+        nedges = len(timestamps)
         edgeCount = [0] * len(self.vertices)
         mapGM = [-1] * len(self.vertices)
         mapMG = [-1] * len(M.vertices)
-        results = []
+        last = len(M.timestamps) - 1
+        count = 0
+        if stop is None:
+            stop = nedges
+        if limit is not None and limit <= 0:
+            return
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if trace:
+            self.eGtrace = array('q')
+            self.eMtrace = array('q')
+            self.estacktrace = array('q')
         eStack = []
-        eG = 0
+        eG = start
         eM = 0
         t = float('inf')
         i = 0
         while True:
             i += 1
             eG = self.find_next_match(M, eM, eG, mapMG, mapGM, t)
-            print('eG : %s' % eG)
-            print('eM : %s' % eM)
-            #print(mapGM)
-            #print(mapMG)
-            if eG < len(self.edges):
+            if not eStack and eG >= stop:
+                # no more first edge in [start, stop)
+                eG = nedges
+            if debug:
+                logger.debug('eG : %s, eM : %s', eG, eM)
+            if trace:
+                self.eGtrace.append(eG)
+                self.eMtrace.append(eM)
+                self.estacktrace.append(len(eStack))
+            if eG < nedges:
             # We matched something !
-                if eM == len(M.edges) - 1:
-                    print('YAYAYAY!!!!!')
-                    edges = [self.edges[e] for e in eStack] + [self.edges[eG]]
-                    results.append(Graph(elist=edges))
+                if eM == last:
+                    if debug:
+                        logger.debug('match : %s', eStack + [eG])
+                    yield tuple(eStack) + (eG,)
+                    count += 1
+                    if count == limit:
+                        return
                 else:
-                    uG, vG = self.to_vertices(eG)
+                    uG, vG = tails[eG], heads[eG]
                     uM, vM = M.to_vertices(eM)
                     mapGM[uG] = uM
                     mapGM[vG] = vM
@@ -479,15 +1855,14 @@ class Graph():
                     edgeCount[uG] += 1
                     edgeCount[vG] += 1
                     if eStack == []:
-                        t = self.edges[eG].timestamp + d
+                        t = timestamps[eG] + d
                     eStack.append(eG)
                     eM += 1
             eG += 1
-            while eG >= len(self.edges) or self.edges[eG].timestamp > t:
+            while eG >= nedges or timestamps[eG] > t:
                 if eStack != []:
                     eG = eStack.pop() + 1
-                    uG, vG = self.to_vertices(eG-1)
-                    uM, vM = M.to_vertices(eM)
+                    uG, vG = tails[eG-1], heads[eG-1]
                     if eStack == []:
                         t = float('inf')
                     edgeCount[uG] -= 1
@@ -496,69 +1871,179 @@ class Graph():
                         uM = mapGM[uG]
                         mapMG[uM] = -1
                         mapGM[uG] = -1
-                    if edgeCount[vG] == 0:
+                    if edgeCount[vG] == 0 and vG != uG: # self-loop done
                         vM = mapGM[vG]
                         mapMG[vM] = -1
                         mapGM[vG] = -1
                     #eG += 1
                     eM -= 1
                 else:
-                    return results
+                    return
+        
+    def multi_match(self, motifs, output='graph'):
+        """
+        Matches several temporal motifs in a single pass over the edges (see
+        MultiStreamMatcher) : the partial matches of motifs starting with the
+        same edges are shared. Returns the list of the results of each motif,
+        as temporal_match would return them.
+        
+        Args:
+        - motifs (list of (Graph, number)): the temporal motifs to search,
+        each with the maximum temporal difference between first edge and last
+        edge in its matched subgraphs.
+        - output (str): 'graph' (default), 'edges' or 'count', as for
+        temporal_match.
+        """
+        if output not in ('graph', 'edges', 'count'):
+            raise ValueError("output must be 'graph', 'edges' or 'count'")
+        self._check_arrays()
+        matcher = MultiStreamMatcher(motifs)
+        results = [[] for _ in motifs]
+        type_names = self.type_names
+        categories = [self.category_names[c] if c >= 0 else None
+                      for c in self.categories.tolist()]
+        for e, (t, u, v, c) in enumerate(zip(self.timestamps.tolist(),
+                                             self.tails.tolist(),
+                                             self.heads.tolist(),
+                                             self.types.tolist())):
+            for _, k, match in matcher._add(t, u, v, type_names[c],
+                                            categories[u], categories[v], e):
+                results[k].append(match)
+        if output == 'count':
+            return [len(matches) for matches in results]
+        # same order as temporal_match, by first edge, then second edge ...
+        for matches in results:
+            matches.sort()
+        if output == 'edges':
+            return results
+        return [[Graph(elist=[self._edge_at(e) for e in match])
+                 for match in matches] for matches in results]
+    
+    def parallel_match(self, M, d, output='graph', workers=None, shards=None):
+        """
+        Temporal subgraph matching over a pool of processes : the edges are
+        split in time shards, each one searched in a separate process for the
+        matches whose first edge is in the shard, with the following edges up
+        to d later. Each match is thus found exactly once, and the results
+        are the same, in the same order, as with temporal_match.
         
+        Args:
+        - M (Graph): the temporal motif to search in the graph.
+        - d (number): the maximum temporal difference between first edge and
+        last edge in matched subgraphs.
+        - output (str): 'graph' (default), 'edges' or 'count', as for
+        temporal_match.
+        - workers (int): number of processes (defaults to the number of cpus).
+        - shards (int): number of shards (defaults to 4 per process, so that
+        shards with many matches don't leave the other processes idle).
+        """
+        if output not in ('graph', 'edges', 'count'):
+            raise ValueError("output must be 'graph', 'edges' or 'count'")
+        self._check_arrays()
+        M._check_arrays()
+        ne = len(self.timestamps)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if shards is None:
+            shards = 4 * workers
+        with ProcessPoolExecutor(workers) as executor:
+            bounds = np.unique(np.linspace(0, ne, shards + 1).astype(np.int64))
+            jobs = []
+            for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                end = int(np.searchsorted(self.timestamps,
+                                          self.timestamps[b-1] + d,
+                                          side='right'))
+                arrays = {name: getattr(self, name)[a:end] for name in
+                          ['timestamps', 'tails', 'heads', 'types']}
+                jobs.append(executor.submit(
+                    _match_shard, arrays, self.type_names, self.categories,
+                    self.category_names, M, d, b - a, output == 'count'))
+            if output == 'count':
+                return sum(job.result() for job in jobs)
+            results = []
+            for a, job in zip(bounds[:-1].tolist(), jobs):
+                results.extend(tuple(a + e for e in match)
+                               for match in job.result())
+        if output == 'edges':
+            return results
+        return [Graph(elist=[self._edge_at(e) for e in match])
+                for match in results]
+    
     def find_next_match(self, M, eM, eG, mapMG, mapGM, t):
         """
         Matchfinding auxilliary function.
         """
         uM, vM = M.to_vertices(eM)
-        #print('uM, vM : %s, %s' % (uM, vM))
-        #print(mapMG)
         uG = mapMG[uM]
         vG = mapMG[vM]
-        # Determine potential edges to try :
-        S = [e for e, edge in enumerate(self.edges) if 
-                e >= eG and edge.timestamp <= t]
+        # types of edges allowed by the motif edge, None for any type, and
+        # categories required for the vertices still unmapped
+        allowed = self._type_codes(M.type_names[M.types[eM]])
+        cu = self._category_code(M.vertices[uM].category) if uG < 0 else None
+        cv = self._category_code(M.vertices[vM].category) if vG < 0 else None
+        # Determine potential edges to try : since edges are sorted by
+        # timestamp, those with timestamp <= t are the ones before end, and
+        # each adjacency index lists its edges in increasing order.
+        end = int(np.searchsorted(self.timestamps, t, side='right'))
         if uG >= 0 and vG >= 0:
-            print('case 0')
-            #'''
-            S = [e for e, edge in enumerate(self.edges) if
-                    e >= eG
-                    and edge.tail == self.vertices[uG].name
-                    and edge.head == self.vertices[vG].name
-                    and edge.timestamp <= t]
-            #'''
-            #S = range(eG, len(self.edges))
+            case = 0
+            lo, hi = self._pair_range(uG, vG)
+            S = self.pair_edges[lo:hi]
         elif uG >= 0:
-            print('case 1')
-            #'''
-            S = [e for e, edge in enumerate(self.edges) if
-                    e >= eG
-                    and edge.tail == self.vertices[uG].name
-                    and edge.timestamp <= t]
-            #'''
-            #S = range(eG, len(self.edges))
+            case = 1
+            S = self.out_edges[self.out_ptr[uG]:self.out_ptr[uG+1]]
         elif vG >= 0:
-            print('case 2')
-            #'''
-            S = [e for e, edge in enumerate(self.edges) if
-                    e >= eG
-                    and edge.head == self.vertices[vG].name
-                    and edge.timestamp <= t]
-            #'''
-            #S = range(eG, len(self.edges))
+            case = 2
+            S = self.in_edges[self.in_ptr[vG]:self.in_ptr[vG+1]]
+        else:
+            case = 3
+            S = None
+        if S is None and allowed is None:
+            S = range(eG, end)
+            ncand = len(S)
+        elif S is None:
+            # the edges of the allowed types, merged in increasing order
+            ptr, type_edges = self._type_index()
+            slices = []
+            for c in allowed.tolist():
+                edges = type_edges[ptr[c]:ptr[c+1]]
+                slices.append(edges[np.searchsorted(edges, eG):
+                                    np.searchsorted(edges, end)])
+            ncand = sum(len(edges) for edges in slices)
+            S = slices[0] if len(slices) == 1 else heapq.merge(*slices)
         else:
-            print('case 3')
-        print('len s : %s' % len(S))
+            S = S[np.searchsorted(S, eG):np.searchsorted(S, end)]
+            if allowed is not None:
+                S = S[np.isin(self.types[S], allowed)]
+            if cu is not None:
+                S = S[self.categories[self.tails[S]] == cu]
+            if cv is not None:
+                S = S[self.categories[self.heads[S]] == cv]
+            S = S.tolist()
+            ncand = len(S)
+        tails = self.tails
+        heads = self.heads
+        categories = self.categories
+        matched = len(self.timestamps)
+        loop = uM == vM
         for e in S:
-            u, v = self.to_vertices(e)
-            #print(eG1)
-            #print(uG1, vG1)
+            u, v = int(tails[e]), int(heads[e])
+            if case == 3 and (cu is not None and categories[u] != cu
+                              or cv is not None and categories[v] != cv):
+                continue
+            # a self-loop of the motif only matches a self-loop, and two
+            # vertices of the motif can't be mapped to the same vertex
+            if (u == v) != loop:
+                continue
             # The mapping must match or be unassigned
             if uG == u or (uG < 0 and mapGM[u] < 0):
                 if vG == v or (vG < 0 and mapGM[v] < 0):
-                    print('matched : %s' % e)
-                    return e
-        print('matched (end) : %s' % len(self.edges) )
-        return len(self.edges) 
+                    matched = int(e)
+                    break
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('case %s, %s candidates, matched : %s',
+                         case, ncand, matched)
+        return matched
     
     def to_vertices(self, e):
         """
@@ -568,50 +2053,507 @@ class Graph():
         Args:
         - e (int): index of the Edge in the Edge list.
         """
-        #print('to v from %s' % e)
-        edge = self.edges[e]
-        return self.get_vertex_index(edge.tail), self.get_vertex_index(edge.head)
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        self._check_arrays()
+        return int(self.tails[e]), int(self.heads[e])
 
+def _match_shard(arrays, type_names, categories, category_names, M, d, stop,
+                 count):
+    """
+    Searches the matches of M whose first edge is before stop in the Graph of
+    the given edge arrays, in a worker process of Graph.parallel_match. The
+    vertex indices are renumbered, so that the shard only has the vertices of
+    its edges. Returns the number of matches if count, or their list.
+    """
+    shard = Graph()
+    vertices, shard.tails, shard.heads = _renumber_vertices(arrays['tails'],
+                                                            arrays['heads'])
+    ne = len(arrays['tails'])
+    shard.timestamps = arrays['timestamps']
+    shard.types = arrays['types']
+    shard.type_names = type_names
+    shard.category_names = category_names
+    shard.categories = categories[vertices]
+    for v in vertices.tolist():
+        shard.add_vertex(v)
+    shard._build_adjacency()
+    shard.n = ne
+    shard.edges = None # only the arrays are used
+    shard._stale = False
+    matches = shard.iter_matches(M, d, stop=stop)
+    if count:
+        return sum(1 for _ in matches)
+    return list(matches)
 
+class MultiStreamMatcher():
+    '''
+    Online temporal matching of several motifs at once over a stream of
+    edges : the edges are given one at a time, in timestamp order, and the
+    complete matches of each motif are returned as soon as their last edge
+    arrives. The matches of a motif are the ones temporal_match would find in
+    the Graph of all the edges of the stream.
+    
+    The motifs are stored in a trie of their edges (their vertices being
+    numbered in order of appearance), so that motifs starting with the same
+    edges share their partial matches : a partial match is only extended once
+    for all the motifs it is a prefix of.
+    
+    Only the partial matches that can still be completed are kept, that is
+    the ones whose first edge is less than d old (d being the largest one of
+    the motifs they are a prefix of), so memory depends on the number of
+    edges in a window of d, not on the length of the stream.
+    
+    Usage :
+        matcher = MultiStreamMatcher([(M1, d1), (M2, d2)])
+        for name, timestamp, tail, head, edge_type in stream:
+            for k, match in matcher.add_edge(name, timestamp, tail, head,
+                                             edge_type):
+                ... # match is a match of the k-th motif
+    
+    Args:
+    - motifs (list of (Graph, number)): the temporal motifs to search, each
+    with the maximum temporal difference between first edge and last edge in
+    its matched subgraphs.
+    '''
+    
+    def __init__(self, motifs):
+        # The trie : for node i, _children[i] maps the (tail, head) motif
+        # vertices, the allowed types and the categories of the tail and head
+        # (None for any) of an edge to the child node, _ends[i] lists the (motif
+        # index, d) of the motifs ending at i, and _dmax[i] is the largest d
+        # of the motifs going through i. Node 0 is the root.
+        self._children = [{}]
+        self._ends = [[]]
+        self._dmax = [0]
+        self.motifs = []
+        self.d = 0 # Largest d of the motifs
+        self.n = 0 # Number of edges received
+        self.t = None # Timestamp of the last edge
+        # The partial matches waiting for the edge of a child node, as
+        # (expiry time, child node, key of the child node, timestamp of the
+        # first edge, edge numbers, edges, graph vertex of each motif vertex
+        # matched so far), grouped by the vertex the next edge must have :
+        # (0, vertex) for its tail, (1, vertex) for its head, None if it can
+        # be any edge.
+        self._partials = {}
+        self._n_partials = 0
+        self._sweep_time = None # Next time expired partials are dropped
+        for M, d in motifs:
+            self.add_motif(M, d)
+    
+    def __len__(self):
+        """
+        Number of partial matches currently kept.
+        """
+        return self._n_partials
+    
+    def add_motif(self, M, d):
+        """
+        Adds a motif to match, before the first edge is added.
+        
+        Args:
+        - M (Graph): the temporal motif to search;
+        - d (number): the maximum temporal difference between first edge and
+        last edge in its matched subgraphs.
+        """
+        if self.n:
+            raise ValueError('motifs must be added before the edges')
+        M._check_arrays()
+        if not len(M.timestamps):
+            raise ValueError('the motif has no edges')
+        labels = {}
+        node = 0
+        self._dmax[0] = max(self._dmax[0], d)
+        for eM in range(len(M.timestamps)):
+            uM, vM = M.to_vertices(eM)
+            for x in (uM, vM):
+                if x not in labels:
+                    labels[x] = len(labels)
+            key = (labels[uM], labels[vM],
+                   _motif_types(M.type_names[M.types[eM]]),
+                   M.vertices[uM].category, M.vertices[vM].category)
+            child = self._children[node].get(key)
+            if child is None:
+                child = self._children[node][key] = len(self._children)
+                self._children.append({})
+                self._ends.append([])
+                self._dmax.append(d)
+            node = child
+            self._dmax[node] = max(self._dmax[node], d)
+        self._ends[node].append((len(self.motifs), d))
+        self.motifs.append((M, d))
+        self.d = max(self.d, d)
+    
+    def _sweep(self, t):
+        """
+        Drops the partial matches that can't be completed anymore at time t.
+        """
+        for key in list(self._partials):
+            partials = [p for p in self._partials[key] if p[0] >= t]
+            if partials:
+                self._partials[key] = partials
+            else:
+                del self._partials[key]
+        self._n_partials = sum(len(p) for p in self._partials.values())
+        # partials created after the sweep expire after t + d at the latest
+        self._sweep_time = t + self.d
+    
+    def _add(self, t, tail, head, edge_type, tail_category, head_category,
+             item):
+        """
+        Does the work of add_edge, for an edge of type edge_type from tail to
+        head at time t, represented by item in the matches. Returns the (edge numbers, motif
+        index, items) of the completed matches.
+        """
+        if self.t is not None and t < self.t:
+            raise ValueError('edges must be added in timestamp order')
+        self.t = t
+        seq = self.n
+        self.n += 1
+        if self._sweep_time is None or t > self._sweep_time:
+            self._sweep(t)
+        children = self._children
+        ends = self._ends
+        dmax = self._dmax
+        matches = []
+        extended = []
+        candidates = [self._partials.get((0, tail), ()),
+                      self._partials.get((1, head), ()),
+                      self._partials.get(None, ()),
+                      # the edge may start a new match
+                      [(t, c, key, t, (), (), ())
+                       for key, c in children[0].items()]]
+        for partials in candidates:
+            for expiry, node, key, t0, seqs, items, mapping in partials:
+                if expiry < t: # expired, not swept yet
+                    continue
+                uM, vM, allowed, uc, vc = key
+                if allowed is not None and edge_type not in allowed:
+                    continue
+                # The mapping must match or be unassigned, with the category
+                # of the motif vertex
+                m = len(mapping)
+                if uM < m:
+                    if mapping[uM] != tail:
+                        continue
+                elif tail in mapping or (uc is not None
+                                         and tail_category != uc):
+                    continue
+                if vM < m:
+                    if mapping[vM] != head:
+                        continue
+                elif head in mapping or (vM == uM) != (head == tail) \
+                        or (vc is not None and head_category != vc):
+                    continue
+                if uM >= m:
+                    mapping += (tail,)
+                if vM >= m and vM != uM:
+                    mapping += (head,)
+                seqs += (seq,)
+                items += (item,)
+                for k, d in ends[node]:
+                    if t - t0 <= d:
+                        matches.append((seqs, k, items))
+                for key, c in children[node].items():
+                    extended.append((t0 + dmax[c], c, key, t0, seqs, items,
+                                     mapping))
+        for p in extended:
+            uM, vM = p[2][:2]
+            mapping = p[6]
+            if uM < len(mapping):
+                key = (0, mapping[uM])
+            elif vM < len(mapping):
+                key = (1, mapping[vM])
+            else:
+                key = None
+            self._partials.setdefault(key, []).append(p)
+        self._n_partials += len(extended)
+        matches.sort(key=lambda match: match[:2])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('edge %s : %s partial matches, %s matches', seq,
+                         self._n_partials, len(matches))
+        return matches
+    
+    def add_edge(self, name, timestamp, tail, head, edge_type=None,
+                 tail_category=None, head_category=None):
+        """
+        Adds the next edge of the stream, and returns the list of the matches
+        it completes, as (motif index, match) pairs, each match being a tuple
+        of Edges, one per edge of the motif. The edges must be given in
+        timestamp order (edges of equal timestamps in the order of the sorted
+        Graph).
+        
+        Args:
+        - name (str): name of the edge;
+        - timestamp (number): timestamp of the edge;
+        - tail (str): name of the vertex this edge is emanating from;
+        - head (str): name of the vertex this edge is pointing to;
+        - edge_type (str): type of the edge (defaults to None);
+        - tail_category, head_category (str): categories of the tail and head
+        (defaults to None).
+        """
+        edge = Edge(name, timestamp, tail, head, edge_type)
+        return [(k, edges) for _, k, edges
+                in self._add(edge.timestamp, tail, head, edge_type,
+                             tail_category, head_category, edge)]
+    
+    def add_edges(self, elist):
+        """
+        Adds the Edges of elist (in timestamp order) and yields the matches as
+        they are completed, as add_edge returns them.
+        
+        Args:
+        - elist (iterable of Edges): the edges to add.
+        """
+        for e in elist:
+            for match in self.add_edge(e.name, e.timestamp, e.tail, e.head,
+                                       e.edge_type):
+                yield match
 
+class StreamMatcher(MultiStreamMatcher):
+    '''
+    Online temporal matching of a single motif over a stream of edges (see
+    MultiStreamMatcher) : add_edge returns the completed matches as tuples of
+    Edges.
+    
+    Usage :
+        matcher = StreamMatcher(M, d)
+        for name, timestamp, tail, head, edge_type in stream:
+            for match in matcher.add_edge(name, timestamp, tail, head,
+                                          edge_type):
+                ...
+    
+    Args:
+    - M (Graph): the temporal motif to search;
+    - d (number): the maximum temporal difference between first edge and
+    last edge in matched subgraphs.
+    '''
+    
+    def __init__(self, M, d):
+        MultiStreamMatcher.__init__(self, [(M, d)])
+    
+    def add_edge(self, name, timestamp, tail, head, edge_type=None,
+                 tail_category=None, head_category=None):
+        """
+        Adds the next edge of the stream, and returns the list of the matches
+        it completes, each one as a tuple of Edges, one per edge of the motif.
+        The edges must be given in timestamp order (edges of equal timestamps
+        in the order of the sorted Graph).
+        
+        Args:
+        - name (str): name of the edge;
+        - timestamp (number): timestamp of the edge;
+        - tail (str): name of the vertex this edge is emanating from;
+        - head (str): name of the vertex this edge is pointing to;
+        - edge_type (str): type of the edge (defaults to None);
+        - tail_category, head_category (str): categories of the tail and head
+        (defaults to None).
+        """
+        return [edges for _, edges in MultiStreamMatcher.add_edge(
+            self, name, timestamp, tail, head, edge_type, tail_category,
+            head_category)]
 
+def load_graph(path):
+    """
+    Loads a saved graph, in the binary format if the extension is .bin.
+    """
+    if path.endswith('.bin'):
+        return Graph(bfile=path)
+    return Graph(efile=path)
 
+class MatchCache():
+    '''
+    A persistent cache of the results of temporal_match on graph files, so
+    that sweeps over graphs that did not change since the previous run don't
+    search them again.
+    
+    Each result is stored in its own file of the cache directory, as the
+    array of the edge indices of the matches, under a key made of a digest of
+    the content of the graph file, of a canonical encoding of the motif (its
+    edges, their types and the categories of its vertices, independently of
+    the names of its vertices and edges) and of d. When the files take more
+    than max_size bytes, the least recently used ones are removed. Several
+    processes can share a cache directory.
+    
+    Usage :
+        cache = MatchCache('../data/cache')
+        n = cache.temporal_match('../data/graphs/insiders/CDE1846.bin', M, d,
+                                 output='count')
+    
+    Args:
+    - directory (str): path of the cache directory, created if needed;
+    - max_size (int): maximum total size of the cached results, in bytes
+    (defaults to 1 GB).
+    '''
+    
+    VERSION = 1 # to change when the stored results change meaning
+    
+    def __init__(self, directory, max_size=2**30):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._fingerprints = {} # (path, size, mtime) -> digest of the file
+        os.makedirs(directory, exist_ok=True)
+    
+    def __repr__(self):
+        return "MatchCache %s: %s hits, %s misses" % (self.directory,
+                                                     self.hits, self.misses)
+    
+    def fingerprint(self, path):
+        """
+        Returns the digest of the content of a file, only read again if its
+        size or modification time changed.
+        """
+        stat = os.stat(path)
+        key = (op.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._fingerprints.get(key)
+        if digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    h.update(block)
+            digest = self._fingerprints[key] = h.hexdigest()
+        return digest
+    
+    @staticmethod
+    def motif_key(M):
+        """
+        Returns a canonical encoding of the motif M, as a string : the edges
+        in order, with the vertices numbered by first appearance, the sorted
+        types they allow and the categories of the vertices. Motifs that only
+        differ by the names of their vertices and edges (or their timestamps,
+        as long as the order is the same) have the same encoding.
+        """
+        M._check_arrays()
+        number = {}
+        edges = []
+        for u, v, c in zip(M.tails.tolist(), M.heads.tolist(),
+                           M.types.tolist()):
+            u = number.setdefault(u, len(number))
+            v = number.setdefault(v, len(number))
+            allowed = _motif_types(M.type_names[c])
+            edges.append([u, v, None if allowed is None else sorted(allowed)])
+        categories = [None] * len(number)
+        for v, i in number.items():
+            categories[i] = M.vertices[v].category
+        return json.dumps({'edges': edges, 'categories': categories})
+    
+    def key(self, path, M, d):
+        """
+        Returns the key of the results of the motif M with d on a graph file.
+        """
+        # the same d as a Python or numpy int or float gives the same key
+        if isinstance(d, (int, np.integer)):
+            d = int(d)
+        else:
+            d = float(d)
+            if d.is_integer():
+                d = int(d)
+        content = json.dumps([self.VERSION, self.fingerprint(path),
+                              self.motif_key(M), d])
+        return hashlib.blake2b(content.encode('utf-8'),
+                               digest_size=16).hexdigest()
+    
+    def _path(self, key):
+        return op.join(self.directory, key + '.npy')
+    
+    def get(self, key):
+        """
+        Returns the cached array of matches of a key, or None.
+        """
+        path = self._path(key)
+        try:
+            matches = np.load(path)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path) # most recently used
+        except OSError:
+            pass
+        return matches
+    
+    def put(self, key, matches):
+        """
+        Stores the array of matches of a key, then removes the least recently
+        used results if the cache got too large.
+        """
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, matches)
+            os.replace(tmp, self._path(key)) # atomic for concurrent readers
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+    
+    def evict(self):
+        """
+        Removes the least recently used results until the cache holds at most
+        max_size bytes. Returns the number of removed results.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError: # removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
+    
+    def temporal_match(self, path, M, d, output='count', prune=False):
+        """
+        Returns graph.temporal_match(M, d, output) for the graph saved in
+        path, from the cache if this graph file was already searched for this
+        motif and d. Otherwise the graph is loaded (see load_graph), searched,
+        and the matches are cached.
+        
+        Args:
+        - path (str): path to a text or binary graph file;
+        - M (Graph): the temporal motif to search in the graph;
+        - d (number): the maximum temporal difference between first edge and
+        last edge in matched subgraphs;
+        - output (str): 'count' (default), 'edges' or 'graph', as for
+        Graph.temporal_match ; 'graph' needs to load the graph even when the
+        matches are cached;
+        - prune (bool): prune the graph before a search (see Graph.prune,
+        defaults to False), which doesn't change the matches.
+        """
+        if output not in ('graph', 'edges', 'count'):
+            raise ValueError("output must be 'graph', 'edges' or 'count'")
+        key = self.key(path, M, d)
+        matches = self.get(key)
+        graph = None
+        if matches is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            graph = load_graph(path)
+            matches = np.array(graph.temporal_match(M, d, output='edges',
+                                                    prune=prune),
+                               dtype=np.int64).reshape(-1, len(M.timestamps))
+            self.put(key, matches)
+        if output == 'count':
+            return len(matches)
+        matches = [tuple(match) for match in matches.tolist()]
+        if output == 'edges':
+            return matches
+        if graph is None:
+            graph = load_graph(path)
+        return [Graph(elist=[graph._edge_at(e) for e in match])
+                for match in matches]
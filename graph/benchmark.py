@@ -0,0 +1,147 @@
+import CERTGraph as cg
+import generate_data
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import os.path as op
+
+# Benchmark of the graph building and matching, on synthetic CERT-like logs
+# (see generate_data.py) so no data is needed. Sweeps the number of rows of the
+# logs, the size of the motif and the maximum duration d of the matches, and
+# writes the timings to a json file. Comparing with the results of a previous
+# run reports regressions.
+#
+# usage : python benchmark.py [--rows 1000 10000] [--motifs 1 2] [--deltas ...]
+#                             [--out results.json] [--compare old.json]
+
+def motif(n):
+    """
+    The motif used in main.py : an edge, n edges out of its head, and the
+    first edge again.
+    """
+    edgelist = []
+    edgelist.append(cg.Edge(0, 0, 0, 1, None))
+    for i in range(n):
+        edgelist.append(cg.Edge(i+1, i+1, 1, i+2, None))
+    edgelist.append(cg.Edge(n+1, n+1, 0, 1, None))
+    return cg.Graph(elist=edgelist)
+
+def timeit(f, repeat):
+    """
+    Returns the result of f() and the best time of repeat runs.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=op.dirname(op.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(rows, motif_sizes, deltas, repeat=3):
+    """
+    Runs the benchmarks and returns the list of results, one dict per
+    measure.
+    """
+    results = []
+    def record(**result):
+        results.append(result)
+        print(', '.join('%s=%s' % item for item in result.items()))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nrows in rows:
+            csv = op.join(tmpdir, 'logs.csv')
+            generate_data.generate(csv, nrows, users=1)
+            def read():
+                graph = cg.Graph()
+                graph.read_data(csv)
+                return graph
+            graph, t = timeit(read, repeat)
+            nedges = len(graph.timestamps)
+            record(bench='read_data', rows=nrows, edges=nedges, time=t)
+            txt = op.join(tmpdir, 'graph.txt')
+            _, t = timeit(lambda: graph.save(txt), repeat)
+            record(bench='save', rows=nrows, edges=nedges, time=t)
+            _, t = timeit(lambda: cg.Graph(efile=txt), repeat)
+            record(bench='read_graph_file', rows=nrows, edges=nedges, time=t)
+            binary = op.join(tmpdir, 'graph.bin')
+            _, t = timeit(lambda: graph.save_binary(binary), repeat)
+            record(bench='save_binary', rows=nrows, edges=nedges, time=t)
+            _, t = timeit(lambda: cg.Graph(bfile=binary), repeat)
+            record(bench='read_binary_file', rows=nrows, edges=nedges, time=t)
+            for n in motif_sizes:
+                M = motif(n)
+                for d in deltas:
+                    count, t = timeit(
+                        lambda: graph.temporal_match(M, d, output='count'),
+                        repeat)
+                    record(bench='temporal_match', rows=nrows, edges=nedges,
+                           motif=n, d=d, matches=count, time=t)
+    return results
+
+def compare(results, previous, threshold):
+    """
+    Prints the benchmarks slower than in previous by more than threshold
+    (relative), and returns their number.
+    """
+    def key(result):
+        return tuple((k, v) for k, v in sorted(result.items())
+                     if k not in ('time', 'matches', 'edges'))
+    old = {key(r): r['time'] for r in previous['results']}
+    slower = 0
+    for result in results:
+        t = old.get(key(result))
+        if t is not None and result['time'] > t * (1 + threshold):
+            slower += 1
+            print('slower : %s, %.4fs -> %.4fs (x%.2f)'
+                  % (dict(key(result)), t, result['time'], result['time'] / t))
+    return slower
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the graphs.')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[1000, 5000, 20000],
+                        help='numbers of rows of the synthetic logs')
+    parser.add_argument('--motifs', type=int, nargs='+', default=[1, 2, 3],
+                        help='sizes n of the motifs (see motif(n))')
+    parser.add_argument('--deltas', type=int, nargs='+',
+                        default=[3600000, 36000000],
+                        help='maximum durations of the matches (ms)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='each measure is the best of repeat runs')
+    parser.add_argument('--out', default='benchmark.json',
+                        help='json file where the results are written')
+    parser.add_argument('--compare', default=None,
+                        help='json results of a previous run to compare to')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown reported by --compare')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.motifs, args.deltas, args.repeat)
+    with open(args.out, 'w') as f:
+        json.dump({
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}, f, indent=1)
+    print('results written to %s' % args.out)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(results, previous, args.threshold):
+            sys.exit(1)
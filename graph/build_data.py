@@ -1,26 +1,87 @@
 import CERTGraph as cg
+import os
+import time
+import argparse
 import os.path as op
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-filenames_ins = sorted(glob(op.join('..', 
-                                    'data', 
-                                    'cert_b_users', 
-                                    'insiders', 
-                                    '*-logs.csv')))
+# Builds the graphs of the users of both populations of the dataset, in
+# parallel. A graph is only rebuilt if its csv is newer than the saved graph
+# (or with --force).
+#
+# usage : python build_data.py [--workers N] [--binary] [--force]
 
-filenames_safe = sorted(glob(op.join('..', 
-                                     'data', 
-                                     'cert_b_users', 
-                                     'safe', 
-                                     '*-logs.csv')))
+populations = ['insiders', 'safe']
 
-for filename in filenames_ins:
+def build(filename, savepath, binary=False):
+    """
+    Reads a user csv and saves its graph. Returns the number of edges and the
+    time it took.
+    """
+    t0 = time.time()
     graph = cg.Graph()
-    print('reading file "%s"' % filename)
     graph.read_data(filename)
-    savepath = '../data/graphs/insiders/' + filename[-16:-9] + '.txt'
-    print('saving at "%s"' % savepath)
-    graph.save(savepath)
+    if binary:
+        graph.save_binary(savepath)
+    else:
+        graph.save(savepath)
+    return graph.n, time.time() - t0
 
+def list_jobs(data_dir, graph_dir, binary=False, force=False):
+    """
+    Lists the (csv, graph file) pairs to build, skipping the graph files more
+    recent than their csv.
+    """
+    ext = '.bin' if binary else '.txt'
+    jobs = []
+    for population in populations:
+        filenames = sorted(glob(op.join(data_dir, population, '*-logs.csv')))
+        for filename in filenames:
+            user = op.basename(filename)[:-len('-logs.csv')]
+            savepath = op.join(graph_dir, population, user + ext)
+            if not force and op.exists(savepath) \
+                    and op.getmtime(savepath) > op.getmtime(filename):
+                continue
+            jobs.append((filename, savepath))
+    return jobs
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the user graphs.')
+    parser.add_argument('--data', default=op.join('..', 'data', 'cert_b_users'),
+                        help='directory holding the populations csv files')
+    parser.add_argument('--out', default=op.join('..', 'data', 'graphs'),
+                        help='directory where the graphs are saved')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes')
+    parser.add_argument('--binary', action='store_true',
+                        help='save the graphs in the binary format')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild up to date graphs')
+    args = parser.parse_args()
 
+    for population in populations:
+        os.makedirs(op.join(args.out, population), exist_ok=True)
+    jobs = list_jobs(args.data, args.out, args.binary, args.force)
+    print('%s graphs to build' % len(jobs))
+
+    t0 = time.time()
+    total_edges = 0
+    total_size = 0
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(build, filename, savepath, args.binary):
+                   (filename, savepath) for filename, savepath in jobs}
+        for future in as_completed(futures):
+            filename, savepath = futures[future]
+            n, t = future.result()
+            size = op.getsize(filename) / 1e6
+            total_edges += n
+            total_size += size
+            print('%s : %s edges, %.1f MB in %.2fs (%.0f edges/s, %.2f MB/s)'
+                  % (savepath, n, size, t, n / t, size / t))
+    t = time.time() - t0
+    if jobs:
+        print('built %s graphs : %s edges, %.1f MB in %.2fs '
+              '(%.0f edges/s, %.2f MB/s)'
+              % (len(jobs), total_edges, total_size, t, total_edges / t,
+                 total_size / t))
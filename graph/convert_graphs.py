@@ -0,0 +1,24 @@
+import sys
+import CERTGraph as cg
+import os.path as op
+from glob import glob
+
+# Converts the text graph files written by build_data.py to the binary graph
+# format (see Graph.save_binary), saved next to them with a .bin extension.
+# Paths to convert can be given on the command line, by default all the graphs
+# in ../data/graphs are converted.
+
+if len(sys.argv) > 1:
+    filenames = sys.argv[1:]
+else:
+    filenames = sorted(glob(op.join('..', 
+                                    'data', 
+                                    'graphs', 
+                                    '*', 
+                                    '*.txt')))
+
+for filename in filenames:
+    graph = cg.Graph(efile=filename)
+    savepath = op.splitext(filename)[0] + '.bin'
+    print('saving "%s" at "%s"' % (filename, savepath))
+    graph.save_binary(savepath)
@@ -0,0 +1,273 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import os.path as op
+
+# Generates synthetic activity logs with the columns of the CERT user logs, to
+# test and load-test the pipeline without the dataset. The number of users,
+# hosts, the rate and mix of events and the number of injected insider motifs
+# can be set ; rows are generated and written by chunks, so tens of millions of
+# rows can be generated with bounded memory.
+#
+# Either one csv with the activity of all users is written, or (with --users-dir)
+# one <user>-logs.csv per user in the insiders/ and safe/ subdirectories, as in
+# ../data/cert_b_users, users with an injected motif being the insiders.
+#
+# usage : python generate_data.py out.csv --rows 1000000 --users 100 \
+#             --hosts 50 --insiders 10
+
+COLUMNS = ['id', 'date', 'service_id', 'user', 'host', 'role', 'projects',
+           'business_unit', 'functional_unit', 'department', 'team',
+           'device_file_tree', 'device_activity', 'email_to', 'email_cc',
+           'email_bcc', 'email_from', 'email_activity', 'email_size',
+           'email_attachments', 'email_content', 'file_filename',
+           'file_activity', 'file_to_removable_media',
+           'file_from_removable_media', 'file_content', 'http_url',
+           'http_activity', 'http_content', 'logon_activity']
+
+# Relative rates of the different kinds of events
+RATES = {'logon': 0.08, 'device': 0.03, 'email': 0.12, 'file': 0.12,
+         'http': 0.65}
+
+ROLES = ['ElectricalEngineer', 'MaterialsEngineer', 'ITAdmin', 'Salesman',
+         'ProductionLineWorker', 'Manager']
+
+START = 1262590680000 # january 2010, in ms
+HOUR = 3600000
+
+class Generator():
+    '''
+    Generator of synthetic CERT-like activity logs.
+
+    Args:
+    - users (int): number of users;
+    - hosts (int): number of hosts;
+    - rates (dict): relative rates of the 'logon', 'device', 'email', 'file'
+    and 'http' events (defaults to RATES);
+    - events_per_hour (number): mean number of events of a user per hour;
+    - seed (int): random seed.
+    '''
+    def __init__(self, users=10, hosts=10, rates=None, events_per_hour=20,
+                 seed=0):
+        self.rng = np.random.RandomState(seed)
+        rng = self.rng
+        self.rates = dict(RATES, **(rates or {}))
+        self.events_per_hour = events_per_hour
+        letters = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+        self.users = np.array(
+            [''.join(rng.choice(letters, 3)) + '%04d' % u
+             for u in range(users)], dtype=object)
+        self.hosts = np.array(['PC-%04d' % h for h in
+                               rng.choice(10000, hosts, replace=False)],
+                              dtype=object)
+        # each user mostly works on their own host
+        self.user_host = rng.randint(0, hosts, users)
+        self.user_role = rng.choice(ROLES, users)
+        self.files = np.array(['C:\\%s%08X.%s' % (
+            rng.choice(['', 'docs\\', 'shared\\']), rng.randint(2**32),
+            rng.choice(['doc', 'pdf', 'txt', 'zip', 'jpg']))
+            for _ in range(max(100, 20 * users))], dtype=object)
+        self.urls = np.array(['http://%s%d.com/%s' % (
+            rng.choice(['news', 'shop', 'blog', 'mail', 'jobs']), u,
+            rng.randint(1000)) for u in range(max(500, 50 * users))],
+            dtype=object)
+        self.contents = np.array(['email content %08X %s' % (
+            rng.randint(2**32), 'lorem ipsum ' * rng.randint(1, 20))
+            for _ in range(max(1000, 100 * users))], dtype=object)
+        self.addresses = np.array(['%s@dtaa.com' % u for u in self.users],
+                                  dtype=object)
+        self.nrows = 0
+        self.time = START
+        self.injected = []
+
+    def chunk(self, nrows, insiders=()):
+        """
+        Generates the next nrows rows of the logs, as a DataFrame sorted by
+        date, with a motif injected for each user index in insiders.
+        """
+        rng = self.rng
+        nusers = len(self.users)
+        span = int(nrows * HOUR / (self.events_per_hour * nusers))
+        df = pd.DataFrame(np.nan, index=np.arange(nrows), columns=COLUMNS,
+                          dtype=object)
+        df['date'] = np.sort(self.time + rng.randint(0, max(1, span), nrows))
+        user = rng.randint(0, nusers, nrows)
+        host = np.where(rng.rand(nrows) < 0.9, self.user_host[user],
+                        rng.randint(0, len(self.hosts), nrows))
+        df['user'] = self.users[user]
+        df['host'] = self.hosts[host]
+        df['role'] = self.user_role[user]
+        kinds = list(self.rates)
+        p = np.array([self.rates[k] for k in kinds], dtype=float)
+        kind = np.array(kinds, dtype=object)[rng.choice(len(kinds), nrows,
+                                                        p=p / p.sum())]
+        df['service_id'] = kind
+        self._fill(df, kind, user)
+        for u in insiders: # motifs last 5 minutes, and end in the chunk
+            self._inject(df, u, self.time
+                         + rng.randint(0, max(1, span - 5 * 60000)))
+        df = df.sort_values('date', kind='stable').reset_index(drop=True)
+        df['id'] = ['{%012X}' % i for i in range(self.nrows,
+                                                 self.nrows + len(df))]
+        df['business_unit'] = 1
+        df['functional_unit'] = '1 - Engineering'
+        df['department'] = '1 - ResearchAndEngineering'
+        df['team'] = '1 - Team'
+        self.nrows += len(df)
+        self.time += span
+        return df
+
+    def _fill(self, df, kind, user):
+        """
+        Fills the activity columns of the rows of each kind.
+        """
+        rng = self.rng
+        m = kind == 'logon'
+        df.loc[m, 'logon_activity'] = rng.choice(['Logon', 'Logoff'], m.sum())
+        m = kind == 'device'
+        activity = rng.choice(['Connect', 'Disconnect'], m.sum())
+        df.loc[m, 'device_activity'] = activity
+        tree = np.full(m.sum(), np.nan, dtype=object)
+        connect = activity == 'Connect'
+        tree[connect] = ['R:\\;R:\\%s' % u
+                         for u in self.users[user[m]][connect]]
+        df.loc[m, 'device_file_tree'] = tree
+        m = kind == 'email'
+        n = m.sum()
+        df.loc[m, 'email_activity'] = rng.choice(['Send', 'View'], n,
+                                                 p=[0.3, 0.7])
+        df.loc[m, 'email_from'] = self.addresses[user[m]]
+        df.loc[m, 'email_to'] = rng.choice(self.addresses, n)
+        df.loc[m, 'email_size'] = rng.randint(1000, 100000, n)
+        df.loc[m, 'email_content'] = rng.choice(self.contents, n)
+        attach = m & (rng.rand(len(df)) < 0.15)
+        df.loc[attach, 'email_attachments'] = [
+            ';'.join('%s(%s)' % (f, rng.randint(10000, 2000000))
+                     for f in rng.choice(self.files, rng.randint(1, 4)))
+            for _ in range(attach.sum())]
+        m = kind == 'file'
+        n = m.sum()
+        df.loc[m, 'file_activity'] = rng.choice(
+            ['File Open', 'File Write', 'File Copy', 'File Delete'], n,
+            p=[0.5, 0.2, 0.2, 0.1])
+        df.loc[m, 'file_filename'] = rng.choice(self.files, n)
+        df.loc[m, 'file_to_removable_media'] = rng.rand(n) < 0.1
+        df.loc[m, 'file_from_removable_media'] = rng.rand(n) < 0.1
+        df.loc[m, 'file_content'] = 'file content'
+        m = kind == 'http'
+        n = m.sum()
+        df.loc[m, 'http_activity'] = 'WWW Visit'
+        urls = rng.choice(self.urls, n)
+        df.loc[m, 'http_url'] = urls
+        df.loc[m, 'http_content'] = ['content of %s' % u for u in urls]
+
+    def _inject(self, df, u, t):
+        """
+        Appends to df the rows of an insider motif of user u starting at t :
+        logon on a host, connection of a device, copy of a file to it, and
+        email sending that file, then disconnection and logoff.
+        """
+        rng = self.rng
+        user = self.users[u]
+        host = self.hosts[self.user_host[u]]
+        f = rng.choice(self.files)
+        rows = [
+            {'service_id': 'logon', 'logon_activity': 'Logon'},
+            {'service_id': 'device', 'device_activity': 'Connect',
+             'device_file_tree': 'R:\\;R:\\%s' % user},
+            {'service_id': 'file', 'file_activity': 'File Copy',
+             'file_filename': f, 'file_to_removable_media': True,
+             'file_from_removable_media': False,
+             'file_content': 'file content'},
+            {'service_id': 'email', 'email_activity': 'Send',
+             'email_from': self.addresses[u],
+             'email_to': 'someone@competitor.com',
+             'email_size': rng.randint(1000, 100000),
+             'email_attachments': '%s(%s)' % (f, rng.randint(10000, 2000000)),
+             'email_content': 'leaked %08X' % rng.randint(2**32)},
+            {'service_id': 'device', 'device_activity': 'Disconnect'},
+            {'service_id': 'logon', 'logon_activity': 'Logoff'}]
+        for i, row in enumerate(rows):
+            row.update(date=t + i * 60000, user=user, host=host,
+                       role=self.user_role[u])
+            df.loc[len(df)] = pd.Series(row, dtype=object)
+        self.injected.append((user, t))
+
+def generate(path, nrows, users=10, hosts=10, insiders=0, rates=None,
+             events_per_hour=20, chunksize=1000000, seed=0, users_dir=False):
+    """
+    Generates synthetic logs and writes them to path. Returns the list of the
+    (user, start date) of the injected insider motifs.
+
+    Args:
+    - path (str): the csv to write, or with users_dir, the directory where
+    the insiders/ and safe/ user csv files are written;
+    - nrows (int): the number of rows, not counting the injected motifs;
+    - users (int): the number of users;
+    - hosts (int): the number of hosts;
+    - insiders (int): the number of insider motifs injected, each in a
+    different user while there are enough users;
+    - rates (dict): relative rates of the kinds of events (see RATES);
+    - events_per_hour (number): mean number of events of a user per hour;
+    - chunksize (int): the number of rows generated and written at once;
+    - seed (int): random seed.
+    """
+    gen = Generator(users, hosts, rates, events_per_hour, seed)
+    insider_users = gen.rng.choice(users, min(insiders, users), replace=False)
+    motif_users = insider_users[np.arange(insiders) % max(1, users)]
+    nchunks = max(1, -(-nrows // chunksize))
+    motif_chunk = gen.rng.randint(0, nchunks, len(motif_users))
+    if users_dir:
+        for population in ('insiders', 'safe'):
+            os.makedirs(op.join(path, population), exist_ok=True)
+    insider_names = set(gen.users[insider_users])
+    written = set()
+    for c in range(nchunks):
+        n = min(chunksize, nrows - c * chunksize)
+        df = gen.chunk(n, motif_users[motif_chunk == c])
+        if not users_dir:
+            df.to_csv(path, mode='w' if c == 0 else 'a', header=c == 0,
+                      index=False)
+            continue
+        for user, udf in df.groupby('user', sort=False):
+            population = 'insiders' if user in insider_names else 'safe'
+            upath = op.join(path, population, user + '-logs.csv')
+            udf.to_csv(upath, mode='a' if upath in written else 'w',
+                       header=upath not in written, index=False)
+            written.add(upath)
+    return gen.injected
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic CERT-like activity logs.')
+    parser.add_argument('path', help='csv file (or directory with '
+                        '--users-dir) to write')
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='number of rows')
+    parser.add_argument('--users', type=int, default=10,
+                        help='number of users')
+    parser.add_argument('--hosts', type=int, default=10,
+                        help='number of hosts')
+    parser.add_argument('--insiders', type=int, default=0,
+                        help='number of injected insider motifs')
+    parser.add_argument('--events-per-hour', type=float, default=20,
+                        help='mean number of events per user and hour')
+    for kind in RATES:
+        parser.add_argument('--%s-rate' % kind, type=float, default=None,
+                            help='relative rate of %s events (default %s)'
+                            % (kind, RATES[kind]))
+    parser.add_argument('--chunksize', type=int, default=1000000,
+                        help='number of rows generated at once')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--users-dir', action='store_true',
+                        help='write one csv per user in insiders/ and safe/')
+    args = parser.parse_args()
+
+    rates = {kind: getattr(args, '%s_rate' % kind) for kind in RATES
+             if getattr(args, '%s_rate' % kind) is not None}
+    injected = generate(args.path, args.rows, args.users, args.hosts,
+                        args.insiders, rates, args.events_per_hour,
+                        args.chunksize, args.seed, args.users_dir)
+    for user, t in injected:
+        print('injected motif : user %s at %s' % (user, t))
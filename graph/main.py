@@ -63,12 +63,10 @@ edgelist.append(cg.Edge(5, 5, 1, 2, None))
 M = cg.Graph(elist=edgelist)
 print(M.vertices)
 
-result = graph.temporal_match(M, d)
+result = graph.temporal_match(M, d, output='count')
 print('result : ')
 print(result)
-if result:
-    print(len(result))
-    print(len(graph.edges))
+print(len(graph.edges))
 
 '''
 deltas = (np.arange(2) + 1) * 36000000 # hour slices
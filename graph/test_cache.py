@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+
+import CERTGraph as cg
+
+# Tests of MatchCache, run with python -m pytest from the graph subdirectory.
+
+def graph(edges):
+    """
+    Graph of the (tail, head) pairs, the i-th one at timestamp i.
+    """
+    return cg.Graph(elist=[cg.Edge('e%s' % i, i, u, v, 'A')
+                           for i, (u, v) in enumerate(edges)])
+
+def motif(names=(1, 2, 3), edge_type=None, category=None, prefix='m'):
+    a, b, c = names
+    return cg.Graph(elist=[cg.Edge(prefix + '0', 0, a, b, edge_type),
+                           cg.Edge(prefix + '1', 1, b, c, None)],
+                    vlist=[cg.Vertex(a, category)])
+
+def test_hit_after_miss(tmp_path):
+    path = str(tmp_path / 'graph.bin')
+    G = graph([('x', 'y'), ('y', 'z'), ('y', 'w'), ('z', 'x')])
+    G.save_binary(path)
+    cache = cg.MatchCache(str(tmp_path / 'cache'))
+    M = motif()
+    expected = G.temporal_match(M, 10, output='edges')
+    assert expected
+    assert cache.temporal_match(path, M, 10, output='edges') == expected
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.temporal_match(path, M, 10, output='edges') == expected
+    assert cache.temporal_match(path, M, 10) == len(expected)
+    assert (cache.hits, cache.misses) == (2, 1)
+    # other d, other results
+    assert cache.temporal_match(path, M, 0) == 0
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_changed_file(tmp_path):
+    path = str(tmp_path / 'graph.txt')
+    graph([('x', 'y'), ('y', 'z')]).save(path)
+    cache = cg.MatchCache(str(tmp_path / 'cache'))
+    M = motif()
+    assert cache.temporal_match(path, M, 10) == 1
+    graph([('x', 'y'), ('y', 'z'), ('y', 'w')]).save(path)
+    assert cache.temporal_match(path, M, 10) == 2
+    assert (cache.hits, cache.misses) == (0, 2)
+
+def test_motif_key():
+    key = cg.MatchCache.motif_key(motif())
+    # the names of the vertices and edges don't matter
+    renamed = motif(names=('c', 'a', 'b'), prefix='other')
+    assert cg.MatchCache.motif_key(renamed) == key
+    assert cg.MatchCache.motif_key(motif(edge_type={'B', 'A'})) \
+        == cg.MatchCache.motif_key(motif(edge_type={'A', 'B'}))
+    # the structure, types and categories do
+    assert cg.MatchCache.motif_key(motif(names=(1, 2, 1))) != key
+    assert cg.MatchCache.motif_key(motif(edge_type='A')) != key
+    assert cg.MatchCache.motif_key(motif(category='user')) != key
+
+def test_key_d(tmp_path):
+    # the same d as a Python or numpy int or float gives the same key
+    path = str(tmp_path / 'graph.txt')
+    graph([('x', 'y')]).save(path)
+    cache = cg.MatchCache(str(tmp_path / 'cache'))
+    M = motif()
+    key = cache.key(path, M, 3600000)
+    for d in (np.int64(3600000), 3600000.0, np.float64(3600000)):
+        assert cache.key(path, M, d) == key
+    assert cache.key(path, M, 3600000.5) != key
+    assert cache.key(path, M, (np.arange(2) + 1)[0] * 3600000) == key
+
+def test_evict(tmp_path):
+    cache = cg.MatchCache(str(tmp_path / 'cache'))
+    matches = np.zeros((10, 2), dtype=np.int64)
+    for i, key in enumerate(('a', 'b', 'c')):
+        cache.put(key, matches)
+        os.utime(cache._path(key), ns=(i * 10**9, i * 10**9))
+    size = os.path.getsize(cache._path('a'))
+    # 'a' was used last, 'b' is the least recently used
+    assert cache.get('a') is not None
+    cache.max_size = 2 * size
+    assert cache.evict() == 1
+    assert sorted(os.listdir(cache.directory)) == ['a.npy', 'c.npy']
+    cache.max_size = 0
+    assert cache.evict() == 2
+    assert cache.get('a') is None
@@ -0,0 +1,116 @@
+import os
+
+import pandas as pd
+import pytest
+
+import CERTGraph as cg
+import generate_data
+
+# Tests of the reading and saving of the graphs, run with python -m pytest
+# from the graph subdirectory : every way of building a graph from the logs
+# or from a saved graph must give the Edges of read_data.
+
+@pytest.fixture(scope='module')
+def csv(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('logs') / 'logs.csv')
+    generate_data.generate(path, 1500, users=3, hosts=4, insiders=2, seed=1)
+    return path
+
+@pytest.fixture(scope='module')
+def graph(csv):
+    graph = cg.Graph()
+    graph.read_data(csv)
+    return graph
+
+def edges(graph):
+    return [(e.name, e.timestamp, e.tail, e.head, e.edge_type)
+            for e in graph.edges]
+
+def vertices(graph):
+    return sorted((v.name, v.category) for v in graph.vertices)
+
+def motif():
+    return cg.Graph(elist=[cg.Edge(0, 0, 0, 1, 'Logon'),
+                           cg.Edge(1, 1, 1, 2, None)],
+                    vlist=[cg.Vertex(2, 'url')])
+
+def assert_same(graph, other):
+    assert edges(other) == edges(graph)
+    assert vertices(other) == vertices(graph)
+    M = motif()
+    assert other.temporal_match(M, 3600000, output='edges') \
+        == graph.temporal_match(M, 3600000, output='edges')
+
+def test_frame_edges(csv):
+    # the vectorized parsing creates the Edges of _parse_row, in order
+    df = pd.read_csv(csv)
+    rows = cg.Graph()
+    for _, row in df.iterrows():
+        rows._parse_row(row)
+    types, times, tails, heads, _, _ = cg.Graph()._frame_edges(df)
+    assert [(t + str(i), time, tail, head, t) for i, (t, time, tail, head)
+            in enumerate(zip(types, times.tolist(), tails, heads))] \
+        == edges(rows)
+    assert {e[4] for e in edges(rows)} >= {'Logon', 'Send', 'Attach'}
+
+def test_read_data(csv, graph):
+    df = pd.read_csv(csv)
+    rows = cg.Graph()
+    for _, row in df.iterrows():
+        rows._parse_row(row)
+    rows.sort_edges()
+    assert edges(graph) == edges(rows)
+    assert graph.get_vertex(graph.edges[0].tail).category is not None
+
+def test_text_file(graph, tmp_path):
+    path = str(tmp_path / 'graph.txt')
+    graph.save(path)
+    assert_same(graph, cg.Graph(efile=path))
+
+def test_old_text_file(graph, tmp_path):
+    # one line per edge, with the names and categories of its vertices
+    path = str(tmp_path / 'graph.txt')
+    with open(path, 'w') as f:
+        for e in graph.edges:
+            f.write('%s,%s,%s\n' % (e.elements_as_str(),
+                                    graph.get_vertex(e.tail).category,
+                                    graph.get_vertex(e.head).category))
+    assert_same(graph, cg.Graph(efile=path))
+
+def test_binary_file(graph, tmp_path):
+    path = str(tmp_path / 'graph.bin')
+    graph.save_binary(path)
+    assert_same(graph, cg.Graph(bfile=path))
+
+def test_read_data_stream(csv, graph, tmp_path):
+    path = str(tmp_path / 'stream.bin')
+    for chunksize in (100, 10000):
+        stream = cg.Graph()
+        stream.read_data_stream(csv, path, chunksize=chunksize)
+        assert_same(graph, stream)
+        # the temporary runs are removed
+        assert os.listdir(str(tmp_path)) == ['stream.bin']
+
+def test_user_subgraphs(graph):
+    users = graph.users()
+    assert len(users) == 3
+    attributed = []
+    for user in users:
+        sub = graph.user_subgraph(user)
+        u = graph.get_vertex_index(user)
+        index = graph.user_edges[graph.user_ptr[u]:graph.user_ptr[u+1]]
+        attributed.extend(index.tolist())
+        assert edges(sub) == [edges(graph)[i] for i in index.tolist()]
+        # the edges going out of the user are all theirs
+        assert sum(e.tail == user for e in sub.edges) \
+            == sum(e.tail == user for e in graph.edges)
+        assert len(sub.vertices) == len({v for e in sub.edges
+                                         for v in (e.tail, e.head)})
+        # same matches as the graph of its Edges
+        other = cg.Graph(elist=sub.edges, vlist=sub.vertices)
+        M = motif()
+        assert [tuple(index[list(m)]) for m in
+                sub.temporal_match(M, 3600000, output='edges')] \
+            == [tuple(index[list(m)]) for m in
+                other.temporal_match(M, 3600000, output='edges')]
+    assert len(set(attributed)) == len(attributed)
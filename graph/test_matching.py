@@ -0,0 +1,251 @@
+import random
+from itertools import combinations
+
+import CERTGraph as cg
+
+# Behaviour tests of the matchers, run with python -m pytest from the graph
+# subdirectory. The matches of each matcher are compared to the ones of a
+# brute force search, on small random graphs.
+
+TYPES = ['A', 'B', 'C']
+CATEGORIES = ['user', 'host']
+
+def graph(edges):
+    """
+    Graph of the (tail, head) pairs, the i-th one at timestamp i.
+    """
+    return cg.Graph(elist=[cg.Edge('e%s' % i, i, u, v, None)
+                           for i, (u, v) in enumerate(edges)])
+
+def random_graph(rng, nedges=20, nvertices=6):
+    """
+    Random graph with typed edges (self-loops and equal timestamps included)
+    and vertex categories.
+    """
+    vlist = [cg.Vertex('v%s' % i, rng.choice(CATEGORIES))
+             for i in range(nvertices)]
+    elist = [cg.Edge('e%s' % i, rng.randrange(30),
+                     rng.choice(vlist).name, rng.choice(vlist).name,
+                     rng.choice(TYPES))
+             for i in range(nedges)]
+    return cg.Graph(elist=elist, vlist=vlist)
+
+def random_motif(rng):
+    """
+    Random motif of 1 to 3 edges, whose edges and vertices may be
+    constrained by types and categories.
+    """
+    nedges = rng.randint(1, 3)
+    elist = []
+    for i in range(nedges):
+        edge_type = rng.choice([None, None, 'A', {'A', 'B'}])
+        elist.append(cg.Edge(i, i, rng.randrange(3), rng.randrange(3),
+                             edge_type))
+    vlist = [cg.Vertex(x, rng.choice([None, None, 'user'])) for x in range(3)]
+    return cg.Graph(elist=elist, vlist=vlist)
+
+def brute_force(G, M, d):
+    """
+    The matches of M in G, as tuples of edge indices in increasing order,
+    found by trying every set of len(M.edges) edges.
+    """
+    matches = []
+    for match in combinations(range(len(G.edges)), len(M.edges)):
+        edges = [G.edges[e] for e in match]
+        if edges[-1].timestamp - edges[0].timestamp > d:
+            continue
+        mapMG = {}
+        mapGM = {}
+        ok = True
+        for eM, eG in zip(M.edges, edges):
+            types = cg._motif_types(eM.edge_type)
+            if types is not None and eG.edge_type not in types:
+                ok = False
+            for xM, xG in ((eM.tail, eG.tail), (eM.head, eG.head)):
+                if xM in mapMG:
+                    ok &= mapMG[xM] == xG
+                    continue
+                category = M.get_vertex(xM).category
+                if xG in mapGM or (category is not None and
+                                   G.get_vertex(xG).category != category):
+                    ok = False
+                    continue
+                mapMG[xM] = xG
+                mapGM[xG] = xM
+        if ok:
+            matches.append(match)
+    return matches
+
+def cases(n, seed=0):
+    """
+    Yields n random (graph, motif, d, brute force matches) cases.
+    """
+    rng = random.Random(seed)
+    for _ in range(n):
+        G = random_graph(rng)
+        M = random_motif(rng)
+        d = rng.choice([0, 5, 15, 100])
+        yield G, M, d, brute_force(G, M, d)
+
+def stream(G, matcher):
+    """
+    Feeds the edges of G to a StreamMatcher, and returns the matches as
+    sorted tuples of edge indices.
+    """
+    index = {e.name: i for i, e in enumerate(G.edges)}
+    matches = []
+    for e in G.edges:
+        for match in matcher.add_edge(e.name, e.timestamp, e.tail, e.head,
+                                      e.edge_type,
+                                      G.get_vertex(e.tail).category,
+                                      G.get_vertex(e.head).category):
+            matches.append(tuple(index[m.name] for m in match))
+    return sorted(matches)
+
+def test_temporal_match():
+    found = 0
+    for G, M, d, expected in cases(150):
+        assert G.temporal_match(M, d, output='edges') == expected
+        assert G.temporal_match(M, d, output='count') == len(expected)
+        graphs = G.temporal_match(M, d)
+        assert [[e.name for e in h.edges] for h in graphs] \
+            == [[G.edges[e].name for e in match] for match in expected]
+        found += len(expected)
+    assert found # the cases are not all without matches
+
+def test_prune():
+    for G, M, d, expected in cases(150, seed=1):
+        assert G.temporal_match(M, d, output='edges', prune=True) == expected
+        keep, report = G.prune(M, d)
+        assert all(keep[e] for match in expected for e in match)
+        assert report['edges'] == int(keep.sum())
+    # windows longer than the graph, whose keys used to overflow
+    for G, M, _, _ in cases(50, seed=6):
+        for d in (29, 2**62, float('inf')):
+            assert G.temporal_match(M, d, output='edges', prune=True) \
+                == brute_force(G, M, d)
+
+def test_iter_matches():
+    for G, M, d, expected in cases(100, seed=2):
+        for limit in (0, 1, 2):
+            assert list(G.iter_matches(M, d, limit=limit)) \
+                == expected[:limit]
+
+def test_match_ranges():
+    # the matches starting in consecutive ranges of edges
+    for G, M, d, expected in cases(100, seed=2):
+        ne = len(G.edges)
+        ranges = [(0, 7), (7, 8), (8, ne)]
+        for prune in (False, True):
+            assert [m for start, stop in ranges for m in
+                    G.iter_matches(M, d, prune=prune, start=start,
+                                   stop=stop)] == expected
+
+def test_multi_match():
+    rng = random.Random(3)
+    for G, M, d, expected in cases(100, seed=3):
+        M2 = random_motif(rng)
+        d2 = rng.choice([0, 5, 15, 100])
+        motifs = [(M, d), (M2, d2), (M, d)]
+        assert G.multi_match(motifs, output='edges') \
+            == [expected, brute_force(G, M2, d2), expected]
+        assert G.multi_match(motifs, output='count')[0] == len(expected)
+
+def test_stream_matcher():
+    for G, M, d, expected in cases(100, seed=4):
+        assert stream(G, cg.StreamMatcher(M, d)) == expected
+
+def test_parallel_match():
+    for G, M, d, expected in cases(4, seed=5):
+        assert G.parallel_match(M, d, output='edges', workers=2,
+                                shards=3) == expected
+        assert G.parallel_match(M, d, output='count', workers=2,
+                                shards=5) == len(expected)
+
+def test_self_loop():
+    # a self-loop of the motif only matches a self-loop, and two vertices of
+    # the motif are never mapped to the same vertex
+    G = graph([('v1', 'v2'), ('v0', 'v2'), ('v2', 'v1'), ('v1', 'v2')])
+    M = graph([(1, 1), (1, 2)])
+    for prune in (False, True):
+        assert G.temporal_match(M, 10, output='edges', prune=prune) == []
+    assert G.multi_match([(M, 10)], output='edges') == [[]]
+    G = graph([('a', 'a'), ('a', 'b'), ('c', 'c'), ('c', 'c')])
+    for prune in (False, True):
+        assert G.temporal_match(M, 10, output='edges', prune=prune) \
+            == [(0, 1)]
+    M = graph([(1, 2)])
+    assert G.temporal_match(M, 10, output='edges') == [(1,)]
+    assert stream(G, cg.StreamMatcher(M, 10)) == [(1,)]
+    # backtracking from a self-loop keeps the mapping of the other vertices
+    G = graph([('a', 'b'), ('c', 'c'), ('d', 'd'), ('e', 'e')])
+    M = cg.Graph(elist=graph([(1, 2), (0, 0), (2, 2)]).edges,
+                 vlist=[cg.Vertex(x) for x in range(3)])
+    assert G.temporal_match(M, 10, output='edges') == []
+
+def test_changed_edges():
+    # the arrays follow the changes made to the Edge list itself
+    G = graph([('x', 'y')])
+    M = graph([(1, 2)])
+    G.edges.append(cg.Edge('b', 1, 'y', 'z'))
+    G.create_vertices()
+    assert G.temporal_match(M, 10, output='count') == 2
+    assert repr(G) == 'Graph: 3 vertices, 2 edges'
+    G.edges = [cg.Edge('c', 0, 'p', 'q')]
+    G.create_vertices()
+    assert G.temporal_match(M, 10, output='count') == 1
+    G.edges = [cg.Edge('a', 0, 'p', 'q'), cg.Edge('b', 1, 'q', 'p')]
+    assert repr(G) == 'Graph: 5 vertices, 2 edges'
+
+def test_new_vertex():
+    # a vertex added after the arrays were built gets a category too
+    G = cg.Graph(elist=graph([('x', 'y')]).edges,
+                 vlist=[cg.Vertex('x', 'user')])
+    M = cg.Graph(elist=graph([(1, 2)]).edges, vlist=[cg.Vertex(1, 'user')])
+    G.add_vertex('w')
+    assert G.temporal_match(M, 10, output='count', prune=True) == 1
+    assert len(G.prune(M, 10)[0]) == 1
+
+def test_window():
+    # a windowed graph has the matches of the graph of the edges in its
+    # window, and only the vertices of these edges
+    rng = random.Random(7)
+    found = 0
+    for _ in range(20):
+        edges = sorted(random_graph(rng, nedges=40).edges,
+                       key=lambda e: e.timestamp)
+        retention = rng.choice([0, 5, 10])
+        M = cg.Graph(elist=random_motif(rng).edges)
+        d = rng.choice([0, retention])
+        W = cg.Graph(retention=retention)
+        for i, e in enumerate(edges):
+            W.add_edge(e.name, e.timestamp, e.tail, e.head, e.edge_type)
+            if i % 4:
+                continue
+            window = [f for f in edges[:i+1]
+                      if f.timestamp >= e.timestamp - retention]
+            assert [f.name for f in W.edges] == [f.name for f in window]
+            assert sorted(v.name for v in W.vertices) \
+                == sorted({v for f in window for v in (f.tail, f.head)})
+            assert all(W.get_vertex_index(v.name) == j
+                       for j, v in enumerate(W.vertices))
+            assert all((W.get_edge(f.name) is None) == (f not in window)
+                       for f in edges[:i+1])
+            G = cg.Graph(elist=window)
+            expected = [[G.edges[f].name for f in match] for match in
+                        G.temporal_match(M, d, output='edges')]
+            assert [[W.edges[f].name for f in match] for match in
+                    W.temporal_match(M, d, output='edges')] == expected
+            found += len(expected)
+    assert found
+
+def test_window_emails():
+    # an evicted email is not matched by content anymore
+    W = cg.Graph(retention=10)
+    email = W._email_name('hello')
+    W.add_edge('Send0', 0, 'h', email, 'Send')
+    assert W._email_name('hello') == email
+    W.add_edge('Logon0', 20, 'u', 'h', 'Logon')
+    assert W.get_vertex(email) is None
+    assert W._email_name('hello') != email
+    assert len(W._email_dict) == 1
@@ -3,55 +3,91 @@ import matplotlib.pyplot as plt
 import time
 from glob import glob
 import os.path as op
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 # =============================================================================
-# Define users to test :
+# Parallel scan of the user graphs :
 # =============================================================================
 
-users = ['CDE1846', 'ACM2278', 'MAB1775']
-
-userfiles = ['../data/graphs/insiders/' + u + '.txt' for u in users]
-
-userfiles = sorted(glob(op.join('..', 'data', 'graphs', 'insiders', \
-    '*.txt')))
-
-# =============================================================================
-# Define pattern to test :
-# =============================================================================
-
-v1 = cg.Vertex(1, None)
-v2 = cg.Vertex(2, None)
-v3 = cg.Vertex(3, None)
-v4 = cg.Vertex(4, None)
-vlist = [v1, v2, v3, v4]
-
-edgelist = []
-edgelist.append(cg.Edge(1, 1, 1, 2, None))
-edgelist.append(cg.Edge(2, 2, 2, 4, None))
-edgelist.append(cg.Edge(3, 3, 4, 3, None))
-edgelist.append(cg.Edge(4, 4, 2, 3, None))
-edgelist.append(cg.Edge(5, 5, 1, 2, None))
-
-M = cg.Graph(data=(vlist, edgelist))
-
-delta = 36000000 # 10 hour
-
-# =============================================================================
-# Run algorithm on the user graphs
-# =============================================================================
-
-num_match = []
-times = []
-t0 = time.time()
-
-for i, path in enumerate(userfiles):
-    graph = cg.Graph(g_file=path)
+def match_user(path, M, delta, cache=None):
+    """
+    Loads a user graph and matches the motif M in it. Returns the path, the
+    number of matches and the time taken by the matching. With a cache
+    directory, the graphs that did not change since they were last matched
+    against M are not loaded, and their time is the one of the cache lookup.
+    """
+    if cache is not None:
+        t0 = time.time()
+        n = cg.MatchCache(cache).temporal_match(path, M, delta, output='count')
+        return path, n, time.time() - t0
+    graph = cg.load_graph(path)
     t0 = time.time()
-    num_match.append(len(graph.temporal_match(M, delta)))
-    times.append(time.time() - t0)
-
-plt.plot(num_match)
-plt.show()
-
-
+    n = graph.temporal_match(M, delta, output='count')
+    return path, n, time.time() - t0
+
+def scan(M, delta, paths, workers=None, cache=None):
+    """
+    Matches the motif M in each of the graph files in paths, over a pool of
+    processes each loading its own graphs. Yields (path, number of matches,
+    matching time) for each graph, as soon as it is done.
+
+    Args:
+    - M (Graph): the temporal motif to search;
+    - delta (number): the maximum duration of the matched subgraphs;
+    - paths (list of str): the paths to the graph files;
+    - workers (int): number of processes (defaults to the number of cpus);
+    - cache (str): directory of a MatchCache keeping the results between
+    runs (defaults to None, no cache).
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(match_user, path, M, delta, cache)
+                   for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+if __name__ == '__main__':
+
+    # =========================================================================
+    # Define users to test :
+    # =========================================================================
+
+    users = ['CDE1846', 'ACM2278', 'MAB1775']
+
+    userfiles = ['../data/graphs/insiders/' + u + '.txt' for u in users]
+
+    userfiles = sorted(glob(op.join('..', 'data', 'graphs', 'insiders', \
+        '*.txt')))
+
+    # =========================================================================
+    # Define pattern to test :
+    # =========================================================================
+
+    edgelist = []
+    edgelist.append(cg.Edge(1, 1, 1, 2, None))
+    edgelist.append(cg.Edge(2, 2, 2, 4, None))
+    edgelist.append(cg.Edge(3, 3, 4, 3, None))
+    edgelist.append(cg.Edge(4, 4, 2, 3, None))
+    edgelist.append(cg.Edge(5, 5, 1, 2, None))
+
+    M = cg.Graph(elist=edgelist)
+
+    delta = 36000000 # 10 hour
+
+    # results of the previous runs, the unchanged graphs are not matched again
+    cache = op.join('..', 'data', 'match_cache')
+
+    # =========================================================================
+    # Run algorithm on the user graphs
+    # =========================================================================
+
+    num_match = {}
+    times = {}
+
+    for path, n, t in scan(M, delta, userfiles, cache=cache):
+        print('%s : %s matches in %.2fs' % (path, n, t))
+        num_match[path] = n
+        times[path] = t
+
+    plt.plot([num_match[path] for path in userfiles])
+    plt.show()